@@ -1,11 +1,13 @@
+import json
+
 from extras.scripts import *
 from django.utils.text import slugify
-from django.contrib.contenttypes.models import ContentType
 
 from dcim.choices import DeviceStatusChoices
-from dcim.models import Device, DeviceRole, DeviceType, Site, Platform, Interface, Manufacturer
+from dcim.models import Device, DeviceRole, DeviceType, Site, Platform, Interface
 from ipam.models import IPAddress, VLAN, VLANGroup
 from extras.models import ConfigTemplate
+from onboarding_utils import PhaseRecorder, UnitOfWork, reference_cache
 
 
 def distribute_items(main_list, ap_count=None, guest_count=None):
@@ -150,32 +152,38 @@ class AddDevices(Script):
     )
     def run(self, data, commit):
 
+        with PhaseRecorder() as phases:
+            uow = UnitOfWork()
+            self.provision(data, uow, phases)
+            phases.start('flush')
+            flushed = uow.flush()
+        self.log_info(f"Provisioning took {phases.count} queries ({flushed} objects flushed once by the unit of work)\n\n{phases.table()}")
+        return json.dumps({'device': data['device_name'], 'phases': phases.phases, 'totals': phases.totals()})
+
+    def provision(self, data, uow, phases):
         # Create access switches
-        switch_role = DeviceRole.objects.get(name='Access Switch')
-        platform = Platform.objects.get(slug='ios')
-        mfr = Manufacturer.objects.get(slug="cisco")
-        switch = Device.objects.create(
+        phases.start('device create')
+        switch_role = reference_cache.get(DeviceRole, name='Access Switch')
+        platform = reference_cache.get(Platform, slug='ios')
+        switch = Device(
             device_type=data['switch_model'],
             name=data['device_name'],
             site=data['site'],
             status=DeviceStatusChoices.STATUS_ACTIVE,
             role=switch_role,
             platform=platform,
-            config_template=ConfigTemplate.objects.get(name='master_temp_acc_v1'),
+            config_template=reference_cache.get(ConfigTemplate, name='master_temp_acc_v1'),
         )
-        switch.save()
-        switch.refresh_from_db()
-
         switch.custom_field_data["gateway"] = data["gateway_address"]
         switch.full_clean()
         switch.save()
-        switch.refresh_from_db()
         self.log_success(f"Created new switch: {switch} with {switch.interfaces.all().count()} interfaces")
         
+        phases.start('VLAN group')
         vlan_group = VLANGroup.objects.create(
                         name=data["device_name"],
                         slug=slugify(data["device_name"]),
-                        scope_type=ContentType.objects.get_for_model(Site),
+                        scope_type=reference_cache.content_type(Site),
                         scope_id=data['site'].id,
                         description="vlan_grp",
                     )
@@ -205,6 +213,7 @@ class AddDevices(Script):
                 description="Guest Vlan",
             )
         self.log_success(f"Created new vlans and added to group: VLANGroup: {vlan_group}, VLANs: {blan}:{mgmt}:{guest}")
+        phases.start('LAG and mgmt interfaces')
         interface_portc = Interface.objects.create(
             device=switch, 
             name=data["lag_name"], 
@@ -231,10 +240,10 @@ class AddDevices(Script):
         mgmt_ip.assigned_object = interface_mgmt
         mgmt_ip.save()
         
-        switch.primary_ip4 = mgmt_ip
-        switch.save()
+        uow.set(switch, primary_ip4=mgmt_ip)
         self.log_success(f"IP Address assigned as primary IPv4 address: {switch.primary_ip4.address}")
 
+        phases.start('port allocation')
         usable_int = switch.interfaces.filter(name__contains='/0/').reverse()
         blan_list, ap_list, guest_list = distribute_items(usable_int, data["ap_count"], data["guest_count"])
         
@@ -264,37 +273,30 @@ class AddDevices(Script):
             
         self.log_success("Updated all interfaces....................................")
 
+        phases.start('uplinks')
         lag_int = switch.interfaces.get(name=data["lag_name"])
         lag_int.tagged_vlans.add(blan, mgmt, guest)
-        lag_int.full_clean()
-        lag_int.save()
         self.log_success(f"Update interface Lag: {lag_int}")
 
         uplink1_int = switch.interfaces.get(name=data["uplink_1"])
-        uplink1_int.mode = "tagged"
-        uplink1_int.description = f"<<{data['uplink_desc_a']}>>"
-        uplink1_int.lag = switch.interfaces.get(name=data["lag_name"])
-        
-        uplink1_int.full_clean()
-        uplink1_int.save()
-        
+        uow.set(
+            uplink1_int,
+            mode="tagged",
+            description=f"<<{data['uplink_desc_a']}>>",
+            lag=lag_int,
+        )
         uplink1_int.tagged_vlans.set([blan, mgmt, guest])
-        uplink1_int.save()
-        uplink1_int.refresh_from_db()
-        self.log_success(f"Update uplink 1: {uplink1_int} tagged={list(uplink1_int.tagged_vlans.values_list('vid', flat=True))}")
+        self.log_success(f"Update uplink 1: {uplink1_int} tagged={[blan.vid, mgmt.vid, guest.vid]}")
         
         uplink2_int = switch.interfaces.get(name=data["uplink_2"])
-        uplink2_int.mode = "tagged"
-        uplink2_int.description = f"<<{data['uplink_desc_b']}>>"
-        uplink2_int.lag = switch.interfaces.get(name=data["lag_name"])
-        
-        uplink2_int.full_clean()
-        uplink2_int.save()
-        
+        uow.set(
+            uplink2_int,
+            mode="tagged",
+            description=f"<<{data['uplink_desc_b']}>>",
+            lag=lag_int,
+        )
         uplink2_int.tagged_vlans.set([blan, mgmt, guest])
-        uplink2_int.save()
-        uplink2_int.refresh_from_db()
-        self.log_success(f"Update uplink 2: {uplink2_int} tagged={list(uplink2_int.tagged_vlans.values_list('vid', flat=True))}")
+        self.log_success(f"Update uplink 2: {uplink2_int} tagged={[blan.vid, mgmt.vid, guest.vid]}")
 
 
 class AssignUplink(Script):
@@ -0,0 +1,382 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+
+
+import contextvars
+import csv
+import io
+import json
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+from dcim.models import Device, DeviceType, Interface, Platform, Site
+from django.db import connection, transaction
+from django.utils.text import slugify
+from extras.scripts import *
+from netaddr import IPNetwork
+from onboarding_plan import OnboardingPlan, apply_onboarding_plan, dump_plans, plan_errors, plan_onboarding
+from onboarding_utils import PhaseRecorder, onboard_switch, resolve_references, trace_cable_paths
+
+MANIFEST_FORMAT_CHOICES = (
+    ('auto', 'Detect from file name'),
+    ('csv', 'CSV'),
+    ('yaml', 'YAML'),
+)
+
+REQUIRED_COLUMNS = (
+    'device_name', 'switch_model', 'mgmt_address', 'gateway_address',
+    'blan_vlan', 'guest_vlan', 'uplink_1', 'uplink_sw_a', 'uplink_intf_sw_a',
+)
+
+INTEGER_COLUMNS = ('stack_member_count', 'mgmt_vlan', 'blan_vlan', 'guest_vlan', 'ap_count', 'guest_count')
+
+
+def parse_manifest(content: str, fmt: str) -> list:
+    """Parse a CSV or YAML manifest into a list of row dicts.
+    A YAML manifest is either a list of rows or a mapping with a 'devices' list.
+    Args:
+        content (str): The manifest file content.
+        fmt (str): 'csv' or 'yaml'.
+    Returns:
+        list: One dict per device row, with empty cells dropped.
+    """
+    if fmt == 'yaml':
+        rows = yaml.safe_load(content) or []
+        if isinstance(rows, dict):
+            rows = rows.get('devices', [])
+    else:
+        rows = list(csv.DictReader(io.StringIO(content)))
+    return [
+        {key.strip(): value for key, value in row.items() if key and value not in (None, '')}
+        for row in rows
+    ]
+
+
+class ManifestResolver:
+    """
+    Resolve the slugs and names in manifest rows to NetBox objects.
+    Every lookup is done once for the whole manifest with an IN query, so
+    forty rows against the same site and model cost the same as one.
+    """
+    def __init__(self, rows: list, default_site=None, default_platform=None):
+        self.default_site = default_site
+        self.default_platform = default_platform
+        self.device_types = DeviceType.objects.in_bulk(self._values(rows, 'switch_model'), field_name='slug')
+        self.sites = Site.objects.in_bulk(self._values(rows, 'site'), field_name='slug')
+        self.platforms = Platform.objects.in_bulk(self._values(rows, 'platform'), field_name='slug')
+        leaf_names = self._values(rows, 'uplink_sw_a') | self._values(rows, 'uplink_sw_b')
+        # Device names are only unique per site, so keep every match and pick by the row's site
+        self.leafs = defaultdict(list)
+        for device in Device.objects.filter(name__in=leaf_names):
+            self.leafs[device.name].append(device)
+        peer_names = self._values(rows, 'uplink_intf_sw_a') | self._values(rows, 'uplink_intf_sw_b')
+        self.leaf_interfaces = {
+            (intf.device_id, intf.name): intf
+            for intf in Interface.objects.filter(device__in=[device for devices in self.leafs.values() for device in devices], name__in=peer_names).select_related('device')
+        }
+
+    @staticmethod
+    def _values(rows: list, column: str) -> set:
+        return {str(row[column]) for row in rows if row.get(column)}
+
+    @staticmethod
+    def _lookup(table: dict, key, label: str):
+        try:
+            return table[key]
+        except KeyError:
+            raise ValueError(f"Unknown {label}: {key}") from None
+
+    def _leaf(self, name: str, site):
+        """The leaf switch called `name`, at the row's site when the name exists at several sites."""
+        candidates = self.leafs.get(name, [])
+        if len(candidates) > 1:
+            candidates = [device for device in candidates if device.site_id == site.pk]
+        if not candidates:
+            raise ValueError(f"Unknown leaf switch: {name}")
+        if len(candidates) > 1:
+            raise ValueError(f"Leaf switch name {name} matches {len(candidates)} devices at {site}")
+        return candidates[0]
+
+    def resolve(self, row: dict) -> dict:
+        """Convert a manifest row into the data dict DeviceOnboardingVersioning.run() receives."""
+        missing = [column for column in REQUIRED_COLUMNS if column not in row]
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+        data = {key: row.get(key) for key in ('device_name', 'gateway_address', 'uplink_1', 'uplink_2', 'lag_desc')}
+        for column in INTEGER_COLUMNS:
+            data[column] = int(row[column]) if row.get(column) is not None else None
+        data['mgmt_vlan'] = data['mgmt_vlan'] or 60
+        data['stack_member_count'] = data['stack_member_count'] or 1
+        data['is_stack_switch'] = data['stack_member_count'] > 1
+        data['lag_name'] = row.get('lag_name', 'Po1')
+        data['lag_desc'] = data['lag_desc'] or 'remotehost=os-z07-41ra0043-01-sw-lef-a/b; port=ae18'
+        data['mgmt_address'] = IPNetwork(row['mgmt_address'])
+        data['switch_model'] = self._lookup(self.device_types, row['switch_model'], 'device type')
+        data['site'] = self._lookup(self.sites, row['site'], 'site') if row.get('site') else self.default_site
+        data['platform'] = self._lookup(self.platforms, row['platform'], 'platform') if row.get('platform') else self.default_platform
+        if data['site'] is None or data['platform'] is None:
+            raise ValueError("No site/platform in the row and no default selected")
+        data['uplink_sw_a'] = self._leaf(row['uplink_sw_a'], data['site'])
+        data['uplink_intf_sw_a'] = self._lookup(self.leaf_interfaces, (data['uplink_sw_a'].pk, row['uplink_intf_sw_a']), 'leaf interface')
+        data['uplink_sw_b'] = None
+        data['uplink_intf_sw_b'] = None
+        if row.get('uplink_sw_b') and row.get('uplink_intf_sw_b'):
+            data['uplink_sw_b'] = self._leaf(row['uplink_sw_b'], data['site'])
+            data['uplink_intf_sw_b'] = self._lookup(self.leaf_interfaces, (data['uplink_sw_b'].pk, row['uplink_intf_sw_b']), 'leaf interface')
+        return data
+
+
+class RollbackRow(Exception):
+    """Raised inside a worker transaction to discard a row when the job runs without commit."""
+
+
+class RowLog:
+    """Prefix job log messages with the manifest row they belong to, so interleaved worker output stays readable."""
+    def __init__(self, script, prefix: str):
+        self.script = script
+        self.prefix = prefix
+
+    def log_success(self, message):
+        self.script.log_success(f"[{self.prefix}] {message}")
+
+    def log_info(self, message):
+        self.script.log_info(f"[{self.prefix}] {message}")
+
+    def log_warning(self, message):
+        self.script.log_warning(f"[{self.prefix}] {message}")
+
+    def log_failure(self, message):
+        self.script.log_failure(f"[{self.prefix}] {message}")
+
+
+def find_conflicts(jobs: list) -> dict:
+    """Find rows that claim an object another row (or an existing cable) already claims.
+    These are the only objects shared between rows, so rejecting the conflicts up
+    front lets every remaining row run in parallel without waiting on the others.
+    Args:
+        jobs (list): (line, data) tuples of resolved manifest rows.
+    Returns:
+        dict: Conflict message by manifest line.
+    """
+    def claims(data):
+        count = data['stack_member_count'] if data['is_stack_switch'] else 1
+        names = [data['device_name']] + [f"{data['device_name']}{i}" for i in range(2, count + 1)]
+        yield from (('device', name) for name in names)
+        yield ('vlan group', (data['site'].pk, slugify(data['device_name'])))
+        for peer in (data['uplink_intf_sw_a'], data['uplink_intf_sw_b']):
+            if peer is not None:
+                yield ('leaf interface', peer.pk)
+
+    counts = Counter(claim for _, data in jobs for claim in claims(data))
+    conflicts = {}
+    for line, data in jobs:
+        for kind, key in claims(data):
+            if counts[(kind, key)] > 1:
+                conflicts[line] = f"{kind} {key} is claimed by more than one manifest row"
+        for peer in (data['uplink_intf_sw_a'], data['uplink_intf_sw_b']):
+            if peer is not None and peer.cable_id:
+                conflicts[line] = f"leaf interface {peer.device.name} {peer.name} is already cabled"
+    return conflicts
+
+
+def format_results(results: list) -> str:
+    """One CSV line per row: line, device, status (onboarded, validated or failed), URL or error, and the row's phases as JSON (empty when it never started)."""
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    for line, name, status, detail, *phases in results:
+        writer.writerow([line, name, status, detail, json.dumps(phases[0] if phases else [])])
+    return output.getvalue()
+
+
+class BatchDeviceOnboarding(Script):
+    """
+    Provision every switch in a CSV/YAML manifest in one job.
+    Each row runs through the same onboarding stages as DeviceOnboardingVersioning,
+    inside its own savepoint so a failing row is reported and rolled back
+    without affecting the others.
+
+    With more than one worker the rows run on a thread pool, each in its own
+    database connection and transaction. Those transactions commit (or roll
+    back when commit is off) independently of the job's own transaction.
+    """
+    class Meta:
+        name = "Batch Device Onboarding"
+        description = "Provision many access switches or stacks from one CSV/YAML manifest"
+        commit_default = False
+        fieldsets = (
+            ('Manifest', ('manifest', 'manifest_format')),
+            ('Defaults', ('site', 'platform')),
+            ('Execution', ('workers', 'plan_only')),
+        )
+
+    manifest = FileVar(
+        description="CSV or YAML manifest, one row per switch/stack. Columns: device_name, switch_model (slug), site (slug), platform (slug), mgmt_address, gateway_address, stack_member_count, mgmt_vlan, blan_vlan, guest_vlan, ap_count, guest_count, uplink_1, uplink_2, uplink_sw_a, uplink_intf_sw_a, uplink_sw_b, uplink_intf_sw_b, lag_name, lag_desc",
+        label='Manifest File',
+    )
+    manifest_format = ChoiceVar(
+        choices=MANIFEST_FORMAT_CHOICES,
+        description="Manifest file format",
+        label='Manifest Format',
+        default='auto',
+    )
+    site = ObjectVar(
+        description="Site used for rows without a site column",
+        model=Site,
+        required=False,
+        label='Default Site'
+    )
+    platform = ObjectVar(
+        description="Device image used for rows without a platform column",
+        model=Platform,
+        required=False,
+        label='Default Device Image'
+    )
+    workers = IntegerVar(
+        description="Number of switches/stacks provisioned concurrently",
+        label='Workers',
+        default=1,
+        min_value=1,
+        max_value=16,
+    )
+    plan_only = BooleanVar(
+        description="Only compute and validate a plan per row and output them as a plan artifact for Apply Onboarding Plans; nothing is written",
+        label='Plan Only',
+        default=False,
+    )
+
+    def plan_rows(self, jobs: list) -> str:
+        plans = []
+        for line, row_data in jobs:
+            plan = plan_onboarding(row_data)
+            errors = plan_errors(plan)
+            if errors:
+                self.log_failure(f"Row {line} ({row_data['device_name']}) has an invalid plan: {'; '.join(errors)}")
+                continue
+            self.log_success(f"Row {line} ({row_data['device_name']}): {plan.summary()}")
+            plans.append(plan)
+        self.log_info(f"Planned {len(plans)} of {len(jobs)} rows")
+        return dump_plans(plans)
+
+    def onboard_row(self, line: int, data: dict, refs: dict, commit: bool, own_transaction: bool, cable_paths: list = None) -> tuple:
+        """Onboard one manifest row atomically and return its result tuple.
+        With `cable_paths`, the row's uplink endpoints are added to it once
+        the row succeeded, for the caller to trace after the whole batch.
+        """
+        name = data['device_name']
+        log = RowLog(self, f"row {line} {name}") if own_transaction else self
+        row_paths = None if cable_paths is None else []
+        phases = PhaseRecorder()
+        try:
+            with transaction.atomic():
+                # Lock every upstream leaf port, free or not, so a concurrent job cannot cable them underneath this row
+                peers = [peer.pk for peer in (data['uplink_intf_sw_a'], data['uplink_intf_sw_b']) if peer is not None]
+                locked = list(Interface.objects.select_for_update().filter(pk__in=peers).order_by('pk'))
+                if any(peer.cable_id for peer in locked):
+                    raise ValueError("An upstream leaf interface was cabled by another job")
+                main_switch = onboard_switch(log, data, refs, phases, cable_paths=row_paths)
+                # Without commit the row is rolled back, here or with the job's transaction, so there is nothing to link to
+                result = (line, name, 'onboarded', main_switch.get_absolute_url(), phases.phases) if commit else (line, name, 'validated', '', phases.phases)
+                if own_transaction and not commit:
+                    raise RollbackRow
+            if row_paths is not None:
+                cable_paths.extend(row_paths)
+        except RollbackRow:
+            pass
+        except Exception as exc:
+            self.log_failure(f"Row {line} ({name}) failed and was rolled back: {exc}")
+            result = (line, name, 'failed', str(exc), phases.phases)
+        finally:
+            if own_transaction:
+                connection.close()
+        return result
+
+    def run(self, data, commit):
+        fmt = data['manifest_format']
+        if fmt == 'auto':
+            fmt = 'yaml' if data['manifest'].name.lower().endswith(('.yaml', '.yml')) else 'csv'
+        rows = parse_manifest(data['manifest'].read().decode('utf-8-sig'), fmt)
+        self.log_info(f"Loaded {len(rows)} manifest rows ({fmt})")
+
+        refs = resolve_references()
+        resolver = ManifestResolver(rows, data['site'], data['platform'])
+
+        results = []
+        jobs = []
+        for line, row in enumerate(rows, start=1):
+            try:
+                jobs.append((line, resolver.resolve(row)))
+            except Exception as exc:
+                self.log_failure(f"Row {line} ({row.get('device_name', '?')}) is invalid: {exc}")
+                results.append((line, row.get('device_name', ''), 'failed', str(exc)))
+        conflicts = find_conflicts(jobs)
+        for line, row_data in jobs:
+            if line in conflicts:
+                self.log_failure(f"Row {line} ({row_data['device_name']}) skipped: {conflicts[line]}")
+                results.append((line, row_data['device_name'], 'failed', conflicts[line]))
+        jobs = [(line, row_data) for line, row_data in jobs if line not in conflicts]
+        if data['plan_only']:
+            return self.plan_rows(jobs)
+
+        if data['workers'] > 1 and len(jobs) > 1:
+            self.log_info(f"Onboarding {len(jobs)} rows on {data['workers']} workers")
+            with ThreadPoolExecutor(max_workers=data['workers']) as pool:
+                futures = [
+                    pool.submit(contextvars.copy_context().run, self.onboard_row, line, row_data, refs, commit, True)
+                    for line, row_data in jobs
+                ]
+                results.extend(future.result() for future in futures)
+        else:
+            # Rows share the script's transaction, so cable paths are traced once after the last row
+            cable_paths = []
+            results.extend(self.onboard_row(line, row_data, refs, commit, False, cable_paths) for line, row_data in jobs)
+            self.log_info(f"Traced {trace_cable_paths(cable_paths)} cable paths")
+        results.sort()
+
+        counts = Counter(result[2] for result in results)
+        self.log_info(f"Batch complete: {counts['onboarded']} onboarded, {counts['validated']} validated without commit, {counts['failed']} failed")
+        return format_results(results)
+
+
+class ApplyOnboardingPlans(Script):
+    """
+    Provision the switches described by a plan artifact from the Plan Only
+    mode of the onboarding scripts. Each plan is re-checked against the
+    current database and applied in its own savepoint, so a stale or
+    conflicting plan is reported without affecting the others.
+    """
+    class Meta:
+        name = "Apply Onboarding Plans"
+        description = "Provision access switches or stacks from previously computed onboarding plans"
+        commit_default = False
+
+    plans = FileVar(
+        description="Plan artifact: one JSON plan per line, as output by Plan Only",
+        label='Plan File',
+    )
+
+    def run(self, data, commit):
+        lines = [line for line in data['plans'].read().decode('utf-8').splitlines() if line.strip()]
+        self.log_info(f"Loaded {len(lines)} plans")
+        refs = resolve_references()
+        results = []
+        cable_paths = []
+        for line, text in enumerate(lines, start=1):
+            name = ''
+            plan_paths = []
+            phases = PhaseRecorder()
+            try:
+                payload = json.loads(text)
+                name = payload.get('inputs', {}).get('device_name', '')
+                with transaction.atomic():
+                    plan = OnboardingPlan.from_dict(payload)
+                    main_switch = apply_onboarding_plan(self, plan, refs, phases, cable_paths=plan_paths)
+                cable_paths.extend(plan_paths)
+                results.append((line, name, 'onboarded', main_switch.get_absolute_url(), phases.phases))
+            except Exception as exc:
+                self.log_failure(f"Plan {line} ({name}) failed and was rolled back: {exc}")
+                results.append((line, name, 'failed', str(exc), phases.phases))
+        self.log_info(f"Traced {trace_cable_paths(cable_paths)} cable paths")
+        succeeded = sum(1 for result in results if result[2] == 'onboarded')
+        self.log_info(f"Apply complete: {succeeded} onboarded, {len(results) - succeeded} failed")
+        return format_results(results)
@@ -0,0 +1,167 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+
+
+import time
+
+from config_render import ConfigWriter, RenderPool, SegmentRenderer, get_render_service, load_render_devices, snapshot_context, snapshot_models
+from dcim.models import Device, DeviceRole, Region, Site
+from django.db.models import F, Q
+from extras.models import Tag
+from extras.scripts import *
+from onboarding_utils import reference_cache
+
+
+def chunked(items: list, size: int):
+    """Yield successive slices of items of at most size elements."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def select_access_switches(sites=None, regions=None, tags=None) -> list:
+    """Return the pks of the access switches to render, one per stack (the VC master).
+    Args:
+        sites: Sites to include.
+        regions: Regions to include, with all their child regions.
+        tags: Only include devices carrying any of these tags.
+    Returns:
+        list: Device primary keys ordered by name.
+    """
+    devices = Device.objects.filter(role=reference_cache.get(DeviceRole, name='Access Switch'))
+    scope = Q()
+    if sites:
+        scope |= Q(site__in=sites)
+    if regions:
+        scope |= Q(site__region__in=Region.objects.get_queryset_descendants(regions, include_self=True))
+    devices = devices.filter(scope)
+    if tags:
+        devices = devices.filter(tags__in=tags).distinct()
+    devices = devices.filter(Q(virtual_chassis__isnull=True) | Q(virtual_chassis__master=F('pk')))
+    return list(devices.order_by('name').values_list('pk', flat=True))
+
+
+class BulkConfigRender(Script):
+    """
+    Render the cisco_iosxe access switch template for every access switch in a
+    site, region or tag selection. Devices are loaded in prefetched batches and
+    each config is written out as soon as it is rendered, so memory use stays
+    bounded by the batch size rather than the fleet size. With several workers
+    at most two batches of snapshots are held at a time.
+    """
+    class Meta:
+        name = "Bulk Config Render"
+        description = "Render configs for all access switches in a site, region or tag selection"
+        commit_default = False
+        job_timeout = 3600
+        fieldsets = (
+            ('Selection', ('sites', 'regions', 'tags')),
+            ('Output', ('output_dir', 'archive', 'batch_size', 'workers', 'incremental')),
+        )
+
+    sites = MultiObjectVar(
+        description="Render every access switch in these sites",
+        model=Site,
+        required=False,
+        label='Sites'
+    )
+    regions = MultiObjectVar(
+        description="Render every access switch in these regions (including child regions)",
+        model=Region,
+        required=False,
+        label='Regions'
+    )
+    tags = MultiObjectVar(
+        description="Only render devices carrying one of these tags",
+        model=Tag,
+        required=False,
+        label='Tags'
+    )
+    output_dir = StringVar(
+        description="Directory the rendered configs are written to",
+        label='Output Directory',
+        default='/opt/netbox/rendered-configs',
+    )
+    archive = BooleanVar(
+        description="Write a single .tar.gz archive instead of one .cfg file per device",
+        default=False,
+        label='Tar Archive',
+    )
+    batch_size = IntegerVar(
+        description="Devices loaded per prefetch batch",
+        label='Batch Size',
+        default=50,
+        min_value=1,
+        max_value=500,
+    )
+    workers = IntegerVar(
+        description="Render processes; above 1, device data is snapshotted and rendered on a process pool",
+        label='Render Workers',
+        default=1,
+        min_value=1,
+        max_value=32,
+    )
+    incremental = BooleanVar(
+        description="Reuse cached segment output and re-render only segments whose inputs changed (single worker)",
+        default=False,
+        label='Incremental Segments',
+    )
+
+    def render_serial(self, pks, batch_size):
+        service = get_render_service()
+        for batch in chunked(pks, batch_size):
+            for device in load_render_devices(batch):
+                try:
+                    yield device, service.render_device(device, prefetch=False)
+                except Exception as exc:
+                    yield device, exc
+
+    def render_incremental(self, pks, batch_size):
+        renderer = SegmentRenderer(get_render_service())
+        for batch in chunked(pks, batch_size):
+            for device in Device.objects.filter(pk__in=batch).select_related('virtual_chassis').order_by('name'):
+                try:
+                    yield device, renderer.render_device(device)
+                except Exception as exc:
+                    yield device, exc
+        self.log_info(f"Segment cache: {renderer.hits} hits, {renderer.misses} re-rendered")
+
+    def render_parallel(self, pks, batch_size, workers):
+        models = snapshot_models()
+        with RenderPool(workers) as pool:
+            submitted = []
+            for batch in chunked(pks, batch_size):
+                # The parent loads and snapshots the next batch while the workers render the previous one,
+                # so at most two batches are held and configs are written as they finish
+                queued = pool.submit([(device, snapshot_context(device, models)) for device in load_render_devices(batch)])
+                yield from pool.results(submitted)
+                submitted = queued
+            yield from pool.results(submitted)
+
+    def run(self, data, commit):
+        if not (data['sites'] or data['regions'] or data['tags']):
+            self.log_failure("Select at least one site, region or tag")
+            return
+
+        pks = select_access_switches(data['sites'], data['regions'], data['tags'])
+        self.log_info(f"Rendering {len(pks)} access switches on {data['workers']} worker(s)")
+        if data['incremental']:
+            results = self.render_incremental(pks, data['batch_size'])
+        elif data['workers'] > 1:
+            results = self.render_parallel(pks, data['batch_size'], data['workers'])
+        else:
+            results = self.render_serial(pks, data['batch_size'])
+
+        started = time.monotonic()
+        failed = 0
+        with ConfigWriter(data['output_dir'], data['archive']) as writer:
+            for device, config in results:
+                if isinstance(config, Exception):
+                    failed += 1
+                    self.log_failure(f"{device.name}: render failed: {config}")
+                else:
+                    writer.write(device.name, config)
+        elapsed = time.monotonic() - started
+
+        rate = writer.count / elapsed if elapsed else 0
+        self.log_success(f"Rendered {writer.count} configs ({writer.bytes / 1024:.0f} KiB) to {writer.path}")
+        self.log_info(f"Total time {elapsed:.1f}s, throughput {rate:.1f} devices/sec, {failed} failed")
@@ -0,0 +1,174 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+"""
+Per-device compliance state for incremental ConfigDiffScript runs.
+
+For each device the store keeps the digests of the last rendered and last
+collected config and when they were checked. A device is only re-rendered,
+re-collected and re-diffed when the change log shows something it renders
+from changed since then, or when its entry is older than the TTL (which is
+what catches drift made directly on the switch).
+"""
+
+import hashlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from core.models import ObjectChange
+from dcim.models import Device, Interface, VirtualChassis
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+from ipam.models import VLAN, VLANGroup
+
+STATE_KEY = 'config_compliance:state:{}'
+
+# Objects shared by many devices. A change to any of them makes every device due.
+GLOBAL_MODELS = (
+    ('extras', 'configtemplate'),
+    ('extras', 'configcontext'),
+    ('ipam', 'service'),
+)
+
+# Device custom field pointing at the VLAN group a switch renders its VLANs from
+VLAN_GROUP_FIELD = 'vlan_group'
+
+
+def digest(text: str) -> str:
+    return hashlib.sha256((text or '').encode()).hexdigest()
+
+
+def last_changed(devices: list, since: datetime) -> tuple:
+    """Find the latest change-log entry affecting each device since a point in time.
+    Changes to the device, to objects related to it or one of its interfaces
+    (IP addresses, cables, ...) and to its virtual chassis count for every
+    member of that chassis, since the master renders the members' ports.
+    Changes to a VLAN group or its VLANs count for the devices whose
+    vlan_group custom field points at that group.
+    Args:
+        devices (list): Devices to check.
+        since (datetime): Oldest last-check time among them.
+    Returns:
+        tuple: (dict of latest change time by device pk, latest global change time or None)
+    """
+    device_type = ContentType.objects.get_for_model(Device)
+    interface_type = ContentType.objects.get_for_model(Interface)
+    chassis_type = ContentType.objects.get_for_model(VirtualChassis)
+    global_types = [ContentType.objects.get_by_natural_key(*model) for model in GLOBAL_MODELS]
+    changes = ObjectChange.objects.filter(time__gt=since)
+
+    global_change = changes.filter(changed_object_type__in=global_types).order_by('-time').values_list('time', flat=True).first()
+    rows = changes.filter(
+        Q(changed_object_type__in=[device_type, chassis_type]) | Q(related_object_type__in=[device_type, interface_type])
+    ).values_list('changed_object_type_id', 'changed_object_id', 'related_object_type_id', 'related_object_id', 'time')
+
+    by_device = defaultdict(lambda: since)
+    by_interface = defaultdict(lambda: since)
+    by_chassis = defaultdict(lambda: since)
+    for changed_type, changed_id, related_type, related_id, time in rows:
+        if changed_type == device_type.pk:
+            target, key = by_device, changed_id
+        elif changed_type == chassis_type.pk:
+            target, key = by_chassis, changed_id
+        elif related_type == device_type.pk:
+            target, key = by_device, related_id
+        else:
+            target, key = by_interface, related_id
+        target[key] = max(target[key], time)
+
+    for interface_id, device_id in Interface.objects.filter(pk__in=list(by_interface)).values_list('pk', 'device_id'):
+        by_device[device_id] = max(by_device[device_id], by_interface[interface_id])
+    by_group = vlan_group_changes(changes)
+    if by_group:
+        for device in devices:
+            group_id = device.custom_field_data.get(VLAN_GROUP_FIELD)
+            if group_id in by_group:
+                by_device[device.pk] = max(by_device[device.pk], by_group[group_id])
+    chassis_ids = {device.virtual_chassis_id for device in devices if device.virtual_chassis_id}
+    if chassis_ids:
+        members = Device.objects.filter(virtual_chassis_id__in=chassis_ids).values_list('pk', 'virtual_chassis_id')
+        for pk, chassis_id in members:
+            by_chassis[chassis_id] = max(by_chassis[chassis_id], by_device.get(pk, since))
+        for device in devices:
+            if device.virtual_chassis_id:
+                by_device[device.pk] = max(by_device[device.pk], by_chassis[device.virtual_chassis_id])
+    return dict(by_device), global_change
+
+
+def vlan_group_changes(changes) -> dict:
+    """Latest change time by VLAN group id, from changes to the groups and to their VLANs.
+    The group of a VLAN is read from the change record, so deleted VLANs count;
+    records without it fall back to the VLAN's current group.
+    """
+    group_type = ContentType.objects.get_for_model(VLANGroup)
+    vlan_type = ContentType.objects.get_for_model(VLAN)
+    rows = changes.filter(changed_object_type__in=[group_type, vlan_type]).values_list(
+        'changed_object_type_id', 'changed_object_id', 'prechange_data', 'postchange_data', 'time'
+    )
+    by_group = {}
+    unresolved = defaultdict(list)
+    for changed_type, changed_id, prechange, postchange, time in rows:
+        if changed_type == group_type.pk:
+            groups = {changed_id}
+        else:
+            groups = {data['group'] for data in (prechange, postchange) if data and data.get('group')}
+            if not groups:
+                unresolved[changed_id].append(time)
+        for group_id in groups:
+            by_group[group_id] = max(by_group.get(group_id, time), time)
+    for vlan_id, group_id in VLAN.objects.filter(pk__in=list(unresolved), group__isnull=False).values_list('pk', 'group_id'):
+        for time in unresolved[vlan_id]:
+            by_group[group_id] = max(by_group.get(group_id, time), time)
+    return by_group
+
+
+class ComplianceState:
+    """
+    Cache-backed per-device state: {'rendered', 'actual', 'checked'}.
+    `select` splits the devices into those due for a check and those skipped;
+    `unchanged` tells whether a freshly rendered and collected device matches
+    its last check, in which case its stored compliance result still stands.
+    """
+    def __init__(self, max_age: timedelta):
+        self.max_age = max_age
+        self.started = timezone.now()
+        self.states = {}
+        self.updates = {}
+
+    def select(self, devices) -> tuple:
+        devices = list(devices)
+        self.states = {
+            int(key.rsplit(':', 1)[1]): state
+            for key, state in cache.get_many([STATE_KEY.format(device.pk) for device in devices]).items()
+        }
+        expiry = self.started - self.max_age
+        known = [device for device in devices if device.pk in self.states and self.states[device.pk]['checked'] > expiry]
+        changed, global_change = last_changed(known, min((self.states[device.pk]['checked'] for device in known), default=self.started))
+        due, skipped = [], []
+        for device in devices:
+            state = self.states.get(device.pk)
+            if state is None or state['checked'] <= expiry:
+                due.append(device)
+            elif (global_change and global_change > state['checked']) or changed.get(device.pk, state['checked']) > state['checked']:
+                due.append(device)
+            else:
+                skipped.append(device)
+        return due, skipped
+
+    def unchanged(self, device) -> bool:
+        state = self.states.get(device.pk)
+        return state is not None and state['rendered'] == digest(device.rendered_config) and state['actual'] == digest(device.actual_config)
+
+    def record(self, device) -> None:
+        """Remember a successfully checked device. Errored devices are left due for the next run."""
+        if device.error:
+            return
+        self.updates[STATE_KEY.format(device.pk)] = {
+            'rendered': digest(device.rendered_config),
+            'actual': digest(device.actual_config),
+            'checked': self.started,
+        }
+
+    def save(self) -> None:
+        cache.set_many(self.updates, None)
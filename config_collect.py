@@ -0,0 +1,178 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+"""
+Concurrent collection of running configs for compliance runs.
+
+The plugin starts a scrapli session for every device at once and only
+diffs after the last one has answered, so a single slow or dead switch
+holds up the whole job. Collector bounds the number of open sessions,
+gives every device its own timeout and retries, and yields devices as
+their configs arrive so the diff stage runs while others are still being
+fetched.
+
+FakeConfigServer serves canned configs over plain TCP so a full run can be
+benchmarked offline:
+
+    python config_collect.py --devices 500 --concurrency 64 --delay 0.05
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+import traceback
+from typing import AsyncIterator, Awaitable, Callable
+
+
+class Collector:
+    """
+    Fetch configs with at most `concurrency` sessions open.
+    `fetch` is an async callable taking a device and returning its config;
+    devices only need a name and writable actual_config/error attributes.
+    """
+    def __init__(self, fetch: Callable[..., Awaitable[str]], concurrency: int = 32, timeout: float = 60, retries: int = 2, backoff: float = 1.0):
+        self.fetch = fetch
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.latency = {}
+        self.attempts = {}
+
+    async def _collect_one(self, device, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            for attempt in range(1, self.retries + 2):
+                self.attempts[device.name] = attempt
+                try:
+                    device.actual_config = await asyncio.wait_for(self.fetch(device), self.timeout)
+                    break
+                except asyncio.TimeoutError:
+                    error = f"No config within {self.timeout}s (attempt {attempt})"
+                except Exception:
+                    error = traceback.format_exc()
+                if attempt <= self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            else:
+                device.error = error
+            self.latency[device.name] = time.perf_counter() - start
+        return device
+
+    async def collect(self, devices: list) -> AsyncIterator:
+        """Yield each device as soon as its config (or final error) is in."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pending = [self._collect_one(device, semaphore) for device in devices if device.error is None]
+        for future in asyncio.as_completed(pending):
+            yield await future
+
+    def summary(self) -> str:
+        if not self.latency:
+            return "No devices collected"
+        values = sorted(self.latency.values())
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        retried = sum(1 for attempts in self.attempts.values() if attempts > 1)
+        return f"Collected {len(values)} configs: median {statistics.median(values):.2f}s, p95 {p95:.2f}s, max {values[-1]:.2f}s, {retried} retried"
+
+
+async def scrapli_fetch(device) -> str:
+    """Fetch the running config the same way the plugin does, raising on a failed command."""
+    from scrapli import AsyncScrapli
+
+    async with AsyncScrapli(**device.to_scrapli()) as conn:
+        result = await conn.send_command(device.command)
+    if result.failed:
+        raise RuntimeError(result.result)
+    return result.result
+
+
+class FakeConfigServer:
+    """
+    TCP responder for offline runs: a client sends a device name on one line
+    and gets that device's canned config back, after `delay` seconds.
+    The first `failures` requests per device are dropped to exercise retries.
+    """
+    def __init__(self, configs: dict, host: str = '127.0.0.1', port: int = 0, delay: float = 0.0, failures: int = 0):
+        self.configs = configs
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.failures = failures
+        self.requests = {}
+        self.server = None
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        name = (await reader.readline()).decode().strip()
+        self.requests[name] = self.requests.get(name, 0) + 1
+        if self.requests[name] > self.failures and name in self.configs:
+            await asyncio.sleep(self.delay)
+            writer.write(self.configs[name].encode())
+            await writer.drain()
+        writer.close()
+
+    async def fetch(self, device) -> str:
+        """Collector fetch function talking to this server."""
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.write(f"{device.name}\n".encode())
+        await writer.drain()
+        data = await reader.read()
+        writer.close()
+        if not data:
+            raise ConnectionError(f"{device.name}: connection closed without a config")
+        return data.decode()
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port, limit=2 ** 20)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class BenchmarkDevice:
+    def __init__(self, name: str, rendered_config: str):
+        self.name = name
+        self.rendered_config = rendered_config
+        self.actual_config = None
+        self.error = None
+        self.diff = ''
+
+
+async def benchmark(devices: int, concurrency: int, delay: float, failures: int, interfaces: int) -> None:
+    from config_diff import ConfigDiff
+
+    rendered = '\n'.join(
+        f"interface GigabitEthernet1/0/{port}\n description port {port}\n switchport mode access\n switchport access vlan 10\n!"
+        for port in range(1, interfaces + 1)
+    )
+    # Every tenth device has drifted on one port
+    configs = {
+        f"sw{index:04}": rendered.replace('description port 1\n', 'description drifted\n') if index % 10 == 0 else rendered
+        for index in range(devices)
+    }
+    fleet = [BenchmarkDevice(name, rendered) for name in configs]
+    start = time.perf_counter()
+    async with FakeConfigServer(configs, delay=delay, failures=failures) as server:
+        collector = Collector(server.fetch, concurrency=concurrency, timeout=max(5.0, delay * 10), backoff=0.1)
+        diff_time = 0.0
+        async for device in collector.collect(fleet):
+            if device.error is None:
+                diff_start = time.perf_counter()
+                device.diff = ConfigDiff(device.rendered_config, device.actual_config).unified(device.name)
+                diff_time += time.perf_counter() - diff_start
+    elapsed = time.perf_counter() - start
+    print(collector.summary())
+    print(f"{devices} devices in {elapsed:.2f}s ({devices / elapsed:.0f}/s), {diff_time:.2f}s spent diffing")
+    print(f"{sum(1 for device in fleet if device.diff)} with diff, {sum(1 for device in fleet if device.error)} errored")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark concurrent config collection against a local fake responder")
+    parser.add_argument('--devices', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--delay', type=float, default=0.05, help="Simulated per-device response time in seconds")
+    parser.add_argument('--failures', type=int, default=0, help="Dropped requests per device before it answers")
+    parser.add_argument('--interfaces', type=int, default=52)
+    args = parser.parse_args()
+    asyncio.run(benchmark(args.devices, args.concurrency, args.delay, args.failures, args.interfaces))
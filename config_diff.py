@@ -0,0 +1,200 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+"""
+Hierarchical diff engine for indentation-structured configs (IOS-XE and friends).
+
+netbox_config_diff compares configs with difflib, netutils and hier_config,
+which together re-read the same text three times and scale badly with config
+length. Here both configs are parsed once into a tree of blocks keyed by their
+line (interface, ACL, policy-map stanzas ...) and every block carries a digest
+of its subtree. Comparison walks the two trees together and only descends into
+blocks whose digests differ, so identical stanzas cost one dict lookup each.
+"""
+
+import hashlib
+from typing import Iterator, NamedTuple
+
+# Blocks whose children are a sequence (ACL entries, banner text) rather than a set.
+# Any change inside them is reported, and remediated, as a replacement of the whole block.
+ORDERED_PREFIXES = ('ip access-list ', 'ipv6 access-list ', 'mac access-list ', 'banner ')
+
+IGNORED_LINES = ('!', 'end', 'Building configuration...')
+
+
+class Block:
+    """One config line and the lines indented under it."""
+    __slots__ = ('line', 'children', 'ordered', 'verbatim', 'digest')
+
+    def __init__(self, line: str, ordered: bool = False, verbatim: bool = False):
+        self.line = line
+        self.children = {}
+        self.ordered = ordered
+        self.verbatim = verbatim
+        self.digest = None
+
+    def add(self, line: str, **kwargs) -> 'Block':
+        # Repeated lines (banner rules, remarks) are told apart by their occurrence number
+        occurrence = 0
+        while (line, occurrence) in self.children:
+            occurrence += 1
+        block = self.children[(line, occurrence)] = Block(line, **kwargs)
+        return block
+
+    def seal(self) -> str:
+        """Compute the subtree digest bottom-up. Unordered children are hashed as a set."""
+        digests = [child.seal() for child in self.children.values()]
+        if not self.ordered:
+            digests.sort()
+        self.digest = hashlib.sha1('\n'.join([self.line, *digests]).encode()).hexdigest()
+        return self.digest
+
+    def lines(self, depth: int = 0) -> Iterator[str]:
+        """Yield the block as config text, children indented one space per level."""
+        yield f"{' ' * depth}{self.line}"
+        for child in self.children.values():
+            yield from child.lines(0 if self.verbatim else depth + 1)
+
+
+class Change(NamedTuple):
+    action: str
+    parents: tuple
+    block: Block
+
+
+def parse_config(text: str) -> Block:
+    """Parse config text into a sealed block tree.
+    Args:
+        text (str): Rendered or running configuration.
+    Returns:
+        Block: The root block; its children are the top-level config lines.
+    """
+    root = Block('')
+    stack = [(-1, root)]
+    lines = iter(text.splitlines())
+    for raw in lines:
+        line = raw.rstrip()
+        stripped = line.lstrip()
+        if not stripped or stripped in IGNORED_LINES or stripped.startswith('!'):
+            continue
+        indent = len(line) - len(stripped)
+        while stack[-1][0] >= indent:
+            stack.pop()
+        parent = stack[-1][1]
+        if indent == 0 and stripped.startswith('banner '):
+            parse_banner(parent.add(stripped, ordered=True, verbatim=True), stripped, lines)
+            continue
+        block = parent.add(stripped, ordered=stripped.startswith(ORDERED_PREFIXES))
+        stack.append((indent, block))
+    root.seal()
+    return root
+
+
+def parse_banner(block: Block, line: str, lines: Iterator[str]) -> None:
+    """Consume banner text up to the closing delimiter; the body is kept verbatim."""
+    tokens = line.split()
+    if len(tokens) < 3:
+        return
+    delimiter = tokens[2][:2] if tokens[2].startswith('^') else tokens[2][0]
+    if delimiter in line.split(delimiter, 1)[1]:
+        return
+    for raw in lines:
+        text = raw.rstrip()
+        if delimiter in text:
+            block.add(text)
+            return
+        block.add(text)
+
+
+def compare(intended: Block, actual: Block, parents: tuple = ()) -> Iterator[Change]:
+    """Yield the blocks missing from and extra in actual, in intended order.
+    Only blocks whose digests differ are descended into.
+    Args:
+        intended (Block): Rendered config tree (or subtree).
+        actual (Block): Running config tree (or subtree) at the same position.
+        parents (tuple): Lines of the enclosing blocks.
+    """
+    for key, block in intended.children.items():
+        other = actual.children.get(key)
+        if other is None:
+            yield Change('+', parents, block)
+        elif block.digest != other.digest:
+            if block.ordered:
+                yield Change('-', parents, other)
+                yield Change('+', parents, block)
+            else:
+                yield from compare(block, other, parents + (block.line,))
+    for key, block in actual.children.items():
+        if key not in intended.children:
+            yield Change('-', parents, block)
+
+
+class ConfigDiff:
+    """
+    Block-level comparison of a rendered and a running config, with the same
+    outputs ConfigCompliance stores: a unified-style diff, the missing and
+    extra lines, and the remediation commands.
+    """
+    def __init__(self, rendered: str, actual: str):
+        self.changes = list(compare(parse_config(rendered), parse_config(actual)))
+
+    @staticmethod
+    def _context(parents: tuple, previous: tuple, prefix: str = '') -> Iterator[str]:
+        # Parent lines shared with the previous change have already been printed
+        common = 0
+        while common < min(len(parents), len(previous)) and parents[common] == previous[common]:
+            common += 1
+        for depth, line in enumerate(parents[common:], start=common):
+            yield f"{prefix}{' ' * depth}{line}"
+
+    def _tree(self, action: str) -> str:
+        output = []
+        previous = ()
+        for change in self.changes:
+            if change.action != action:
+                continue
+            output.extend(self._context(change.parents, previous))
+            output.extend(change.block.lines(len(change.parents)))
+            previous = change.parents
+        return '\n'.join(output)
+
+    def missing(self) -> str:
+        """Lines in the rendered config that the device does not have."""
+        return self._tree('+')
+
+    def extra(self) -> str:
+        """Lines on the device that the rendered config does not have."""
+        return self._tree('-')
+
+    def unified(self, name: str) -> str:
+        """A unified-style diff from the running to the rendered config, with parent lines as context."""
+        if not self.changes:
+            return ''
+        output = [f"--- {name} (actual)", f"+++ {name} (intended)"]
+        previous = ()
+        for change in self.changes:
+            output.extend(self._context(change.parents, previous, prefix=' '))
+            output.extend(f"{change.action}{line}" for line in change.block.lines(len(change.parents)))
+            previous = change.parents
+        return '\n'.join(output)
+
+    def patch(self) -> str:
+        """Commands that turn the running config into the rendered one.
+        Within each stanza the removals come first, so a negated old value
+        (no description ...) never clears the new value that follows it.
+        """
+        groups = {}
+        for change in self.changes:
+            groups.setdefault(change.parents, ([], []))[change.action == '+'].append(change.block)
+        output = []
+        for parents, (removed, added) in groups.items():
+            output.extend(f"{' ' * depth}{line}" for depth, line in enumerate(parents))
+            indent = ' ' * len(parents)
+            added_lines = {block.line for block in added}
+            for block in removed:
+                line = ' '.join(block.line.split()[:2]) if block.verbatim else block.line
+                negated = line[3:] if line.startswith('no ') else f"no {line}"
+                if negated not in added_lines:
+                    output.append(f"{indent}{negated}")
+            for block in added:
+                output.extend(block.lines(len(parents)))
+        return '\n'.join(output)
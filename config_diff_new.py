@@ -1,6 +1,17 @@
-from extras.scripts import Script
+import asyncio
+from datetime import timedelta
 
+from extras.scripts import BooleanVar, IntegerVar, Script
+
+from compliance_state import ComplianceState
+from config_collect import Collector, scrapli_fetch
+from config_diff import ConfigDiff
 from netbox_config_diff.compliance.base import ConfigDiffBase
+from netbox_config_diff.compliance.utils import exclude_lines
+
+# Drivers whose configs are indentation-structured and handled by the native block diff.
+# Everything else falls back to the plugin's difflib/netutils/hier_config pipeline.
+BLOCK_DIFF_PLATFORMS = ("cisco_iosxe", "cisco_nxos", "arista_eos")
 
 
 class ConfigDiffScript(ConfigDiffBase, Script):
@@ -8,5 +19,97 @@ class ConfigDiffScript(ConfigDiffBase, Script):
         description = "Checks for configuration difference."
         job_timeout = 600
 
-    def run(self, data: dict, commit: bool) -> None:
-        self.run_script(data)
+    concurrency = IntegerVar(
+        default=32,
+        min_value=1,
+        max_value=256,
+        description="Devices collected at the same time",
+    )
+    timeout = IntegerVar(
+        default=60,
+        min_value=5,
+        description="Seconds to wait for one device's config before retrying",
+    )
+    retries = IntegerVar(
+        default=2,
+        min_value=0,
+        max_value=5,
+        description="Retries per device after a timeout or connection error",
+    )
+    incremental = BooleanVar(
+        default=False,
+        description="Only check devices changed in NetBox since their last check, or last checked longer ago than the max age",
+    )
+    max_age = IntegerVar(
+        default=168,
+        min_value=1,
+        description="Hours after which a device is checked again even without NetBox changes (catches drift on the switch)",
+    )
+
+    def run(self, data: dict, commit: bool) -> str:
+        return self.run_script(data)
+
+    def run_script(self, data: dict) -> str:
+        devices = self.validate_data(data)
+        self.state = None
+        self.unchanged = set()
+        if data["incremental"]:
+            self.state = ComplianceState(timedelta(hours=data["max_age"]))
+            devices, skipped = self.state.select(devices)
+            self.log_info(f"Incremental run: {len(devices)} device(s) due, {len(skipped)} skipped")
+        devices = list(self.get_devices_with_rendered_configs(devices))
+        collector = None
+        if data["data_source"] or data["custom_field"]:
+            self.get_actual_configs(devices)
+            self.get_diff([device for device in devices if not self.is_unchanged(device)])
+        else:
+            collector = Collector(
+                scrapli_fetch, concurrency=data["concurrency"], timeout=data["timeout"], retries=data["retries"]
+            )
+            asyncio.run(self.collect_and_diff(collector, devices))
+            self.log_info(collector.summary())
+        self.update_in_db([device for device in devices if device.pk not in self.unchanged])
+        if self.state:
+            if self.unchanged:
+                self.log_info(f"{len(self.unchanged)} device(s) rendered and collected identically to their last check")
+            for device in devices:
+                self.state.record(device)
+            self.state.save()
+        if collector is None:
+            return ""
+        return "\n".join(
+            f"{device.name},{collector.latency.get(device.name, 0):.2f},{collector.attempts.get(device.name, 0)},{'unchanged' if device.pk in self.unchanged else device.get_status()}"
+            for device in devices
+        )
+
+    def is_unchanged(self, device) -> bool:
+        # Same rendered intent and same running config as last time: the stored result still stands
+        if device.error is None and self.state and self.state.unchanged(device):
+            self.unchanged.add(device.pk)
+            return True
+        return False
+
+    async def collect_and_diff(self, collector: Collector, devices: list) -> None:
+        # Each config is diffed as soon as it arrives, while the slower devices are still being fetched
+        async for device in collector.collect(devices):
+            if device.error is None and not self.is_unchanged(device):
+                self.get_diff([device])
+
+    def get_diff(self, devices: list) -> None:
+        fallback = []
+        for device in devices:
+            if device.error is not None:
+                continue
+            if device.platform not in BLOCK_DIFF_PLATFORMS:
+                fallback.append(device)
+                continue
+            cleaned_config = exclude_lines(device.actual_config, device.exclude_regex.splitlines())
+            if self.substitutes.get(device.platform):
+                cleaned_config = exclude_lines(cleaned_config, self.substitutes[device.platform])
+            diff = ConfigDiff(device.rendered_config, cleaned_config)
+            device.diff = diff.unified(device.name)
+            device.missing = diff.missing()
+            device.extra = diff.extra()
+            device.patch = diff.patch()
+        if fallback:
+            super().get_diff(fallback)
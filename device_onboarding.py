@@ -1,50 +1,16 @@
+import json
+
 from extras.scripts import *
 from django.utils.text import slugify
-from django.contrib.contenttypes.models import ContentType
 from typing import Tuple
 
 from dcim.choices import DeviceStatusChoices
-from dcim.models import Device, DeviceRole, DeviceType, Site, Platform, Interface, Manufacturer, VirtualChassis, InterfaceTemplate
+from dcim.models import Device, DeviceRole, DeviceType, Site, Platform, Interface, VirtualChassis
 from ipam.models import IPAddress, VLAN, VLANGroup 
 from extras.models import ConfigTemplate
-
-def to_one_ended(new_int: str) -> str:
-    return new_int[:-1] + "1"
-
-def replace_slot_(int_name: str | InterfaceTemplate , new_slot: int):
-    """Replace the slot number in an interface name with a new slot number.
-    Args:
-        int_name (str | InterfaceTemplate): The original interface name or template.
-        new_slot (int): The new slot number to replace the old one.
-    Returns:
-        str: The modified interface name with the new slot number.
-    """
-    if isinstance(int_name, InterfaceTemplate):
-        int_name = int_name.name
-    int_name_list = int_name.split('/')
-    new_int = int_name_list[0][:-1]
-    module_num = str(new_slot)
-    int_name_list[0] = new_int + module_num
-    return '/'.join(int_name_list)
-
-def replace_slot(interface: str, new_slot: int) -> str:
-    """
-    Replace the first number after the interface type with the given integer.
-    Example: "GigabitEthernet1/0/1", 2 -> "GigabitEthernet2/0/1"
-    """
-    # Find where the digits start
-    i = 0
-    while i < len(interface) and not interface[i].isdigit():
-        i += 1
-    if i == len(interface):
-        raise ValueError("No numeric part found in the interface string.")
-
-    # Find the end of the first numeric segment
-    j = i
-    while j < len(interface) and interface[j].isdigit():
-        j += 1
-
-    return interface[:i] + str(new_slot) + interface[j:]
+from model_capabilities import UplinkChoicesForm
+from interface_names import member_uplink, with_slot
+from onboarding_utils import PhaseRecorder, reference_cache
 
 def per_switch_with_adding(ap_count: int, num_switches: int) -> Tuple[int,int,int]:
     if num_switches < 1:
@@ -85,70 +51,14 @@ def distribute_items(main_list, ap_count=None, guest_count=None):
 
     return main_list, ap_list, guest_list
 
-CHOICES = (
-    ('TenGigabitEthernet1/1/1', 'Te1/1/1'),
-    ('TenGigabitEthernet1/1/2', 'Te1/1/2'),
-    ('TenGigabitEthernet1/1/3', 'Te1/1/3'),
-    ('TenGigabitEthernet1/1/4', 'Te1/1/4'),
-    ('TwentyFiveGigabitEthernet1/1/1', 'Twe1/1/1'),
-    ('TwentyFiveGigabitEthernet1/1/2', 'Twe1/1/2'),
-    ('GigabitEthernet1/1', 'Gi1/1'),
-    ('GigabitEthernet1/2', 'Gi1/2'),
-)
-
 LAG_CHOICES = (
     ('Po1', 'Po1'),
     ('Po2', 'Po2'),
     ('Po3', 'Po3'),
 )
 
-choices1 = (
-    ('TenGigabitEthernet1/1/1', 'Te1/1/1'),
-    ('TenGigabitEthernet1/1/2', 'Te1/1/2'),
-    ('TenGigabitEthernet1/1/3', 'Te1/1/3'),
-    ('TenGigabitEthernet1/1/4', 'Te1/1/4'),
-)
 
-choices2 = (
-    ('GigabitEthernet1/1/1', 'Gi1/1/1'),
-    ('GigabitEthernet1/1/2', 'Gi1/1/2'),
-    ('TenGigabitEthernet1/1/3', 'Te1/1/3'),
-    ('TenGigabitEthernet1/1/4', 'Te1/1/4'),
-)
-
-choices3 = (
-    ('TwentyFiveGigabitEthernet1/1/1', 'Twe1/1/1'),
-    ('TwentyFiveGigabitEthernet1/1/2', 'Twe1/1/2'),
-    ('TwentyFiveGigabitEthernet1/1/3', 'Twe1/1/3'),
-    ('TwentyFiveGigabitEthernet1/1/4', 'Twe1/1/4'),
-)
-
-choices4 = (
-    ('GigabitEthernet1/1', 'Gi1/1'),
-    ('GigabitEthernet1/2', 'Gi1/2'),
-    ('GigabitEthernet1/3', 'Gi1/3'),
-    ('GigabitEthernet1/4', 'Gi1/4'),
-)
-
-CHOICES_BY_MODEL = {
-    "cisco-c9300l-24p-4x": choices1,
-    "cisco-c9300l-48uxg-4x": choices1,
-    "cisco-c9300lm-24u-4y": choices3,
-    "cisco-c9200cx-12p-2x2g": choices2,
-    "cisco-ie-4000-8gt8gp4g-e": choices4,
-}
-    
-def uplink_choices(data=None):
-    # NetBox may call with no args or with a dict of current form values
-    if not isinstance(data, dict):
-        return ()
-    dt = data.get("switch_model")  # DeviceType instance or None
-    if not dt:
-        return ()
-    slug = dt.slug  # ensure a string key
-    return CHOICES_BY_MODEL.get(slug, ())
-
-class DeviceOnboarding(Script):
+class DeviceOnboarding(UplinkChoicesForm, Script):
 
     class Meta:
         name = "Device Onboarding"
@@ -225,7 +135,7 @@ class DeviceOnboarding(Script):
         max_value=10,
     )
     uplink_1 = ChoiceVar(
-        choices=CHOICES,
+        choices=(),
         description="Uplink Interface drop-down",
         label='Uplink Interface',
     )
@@ -235,7 +145,7 @@ class DeviceOnboarding(Script):
         default='remotehost=os-z07-41ra0043-01-sw-lef-a; port=xe-0/0/18',
     )
     uplink_2 = ChoiceVar(
-        choices=CHOICES,
+        choices=(),
         description="Uplink Interface drop-down",
         label='Uplink Interface',
     )
@@ -256,11 +166,16 @@ class DeviceOnboarding(Script):
         default='remotehost=os-z07-41ra0043-01-sw-lef-a/b; port=ae18'
     )
     def run(self, data, commit):
+        with PhaseRecorder() as phases:
+            self.provision(data, phases)
+        self.log_info(f"Onboarding took {phases.count} queries\n\n{phases.table()}")
+        return json.dumps({'device': data['device_name'], 'phases': phases.phases, 'totals': phases.totals()})
 
+    def provision(self, data, phases):
+        phases.start('device create')
         # Create access switches
-        switch_role = DeviceRole.objects.get(name='Access Switch')
-        platform = Platform.objects.get(slug='ios')
-        mfr = Manufacturer.objects.get(slug="cisco")
+        switch_role = reference_cache.get(DeviceRole, name='Access Switch')
+        platform = reference_cache.get(Platform, slug='ios')
         switch = Device.objects.create(
             device_type=data['switch_model'],
             name=data['device_name'],
@@ -268,17 +183,18 @@ class DeviceOnboarding(Script):
             status=DeviceStatusChoices.STATUS_ACTIVE,
             role=switch_role,
             platform=platform,
-            config_template=ConfigTemplate.objects.get(name='master_temp_acc_v1'),
+            config_template=reference_cache.get(ConfigTemplate, name='master_temp_acc_v1'),
         )
         switch.custom_field_data["gateway"] = data["gateway_address"]
         switch.full_clean()
         switch.save()
         switch.refresh_from_db()
         self.log_success(f"Created new switch: {switch} with {switch.interfaces.all().count()} interfaces")
+        phases.start('VLAN group')
         vlan_group = VLANGroup.objects.create(
                         name=data["device_name"],
                         slug=slugify(data["device_name"]),
-                        scope_type=ContentType.objects.get_for_model(Site),
+                        scope_type=reference_cache.content_type(Site),
                         scope_id=data['site'].id,
                         description="vlan_grp",
                     )
@@ -308,6 +224,7 @@ class DeviceOnboarding(Script):
                 description="Guest Vlan",
             )
         self.log_success(f"Created new vlans and added to group: VLANGroup: {vlan_group}, VLANs: {blan}:{mgmt}:{guest}")
+        phases.start('LAG and mgmt interfaces')
         interface_portc = Interface.objects.create(
             device=switch, 
             name=data["lag_name"], 
@@ -338,6 +255,7 @@ class DeviceOnboarding(Script):
         switch.save()
         self.log_success(f"IP Address assigned as primary IPv4 address: {switch.primary_ip4.address}")
 
+        phases.start('port allocation')
         usable_int = switch.interfaces.filter(name__contains='/0/').reverse()
         blan_list, ap_list, guest_list = distribute_items(usable_int, data["ap_count"], data["guest_count"])
         
@@ -367,6 +285,7 @@ class DeviceOnboarding(Script):
             
         self.log_success("Updated all interfaces....................................")
 
+        phases.start('uplinks')
         lag_int = switch.interfaces.get(name=data["lag_name"])
         lag_int.tagged_vlans.add(blan, mgmt, guest)
         lag_int.full_clean()
@@ -400,7 +319,7 @@ class DeviceOnboarding(Script):
         self.log_success(f"Update uplink 2: {uplink2_int} tagged={list(uplink2_int.tagged_vlans.values_list('vid', flat=True))}")
 
 
-class DeviceOnboardingVersioning(Script):
+class DeviceOnboardingVersioning(UplinkChoicesForm, Script):
     class Meta:
         name = "Device Onboarding Autopilot"
         description = "Automatically selects the optimal uplink for each device model, with full support for stacked switches"
@@ -484,7 +403,7 @@ class DeviceOnboardingVersioning(Script):
         max_value=10,
     )
     uplink_1 = ChoiceVar(
-        choices=CHOICES,
+        choices=(),
         description="Uplink Interface drop-down",
         label='Uplink Interface',
     )
@@ -494,7 +413,7 @@ class DeviceOnboardingVersioning(Script):
         default='remotehost=os-z07-41ra0043-01-sw-lef-a; port=xe-0/0/18',
     )
     uplink_2 = ChoiceVar(
-        choices=CHOICES,
+        choices=(),
         description="Uplink Interface drop-down",
         label='Uplink Interface',
     )
@@ -516,9 +435,16 @@ class DeviceOnboardingVersioning(Script):
     )
     
     def run(self, data, commit):
-        switch_role = DeviceRole.objects.get(name='Access Switch')
-        platform = Platform.objects.get(slug='ios')
-        config_template = ConfigTemplate.objects.get(name='master_temp_acc_v1')
+        with PhaseRecorder() as phases:
+            self.provision(data, phases)
+        self.log_info(f"Onboarding took {phases.count} queries\n\n{phases.table()}")
+        return json.dumps({'device': data['device_name'], 'phases': phases.phases, 'totals': phases.totals()})
+
+    def provision(self, data, phases):
+        phases.start('device create')
+        switch_role = reference_cache.get(DeviceRole, name='Access Switch')
+        platform = reference_cache.get(Platform, slug='ios')
+        config_template = reference_cache.get(ConfigTemplate, name='master_temp_acc_v1')
     
         # Determine stack count: 1 if not stack, or user-specified count if stack
         stack_count = data.get("stack_member_count") if data.get("is_stack_switch") else 1
@@ -550,6 +476,7 @@ class DeviceOnboardingVersioning(Script):
             devices.append(switch)
             self.log_success(f"Created switch: {switch.name} with {switch.interfaces.all().count()} interfaces")
         
+        phases.start('VC build')
         if data['is_stack_switch'] and (stack_count > 1):
             self.log_success(f"Stack creation complete. Total members: {len(devices)}")
             vc = VirtualChassis.objects.create(
@@ -565,19 +492,21 @@ class DeviceOnboardingVersioning(Script):
                     vc.refresh_from_db()
                 device.refresh_from_db()
 
+        phases.start('renumber')
         for idx, device in enumerate(devices, start=1):
             if idx > 1:
                 for intf in device.interfaces.all():
-                    intf.name = replace_slot_(intf.name, idx)
+                    intf.name = with_slot(intf.name, idx)
                     intf.save()
                 
                 device.refresh_from_db()
                 self.log_success(f"Interface name has been updated for stack member {idx}")
 
+        phases.start('VLAN group')
         vlan_group = VLANGroup.objects.create(
                         name=data["device_name"],
                         slug=slugify(data["device_name"]),
-                        scope_type=ContentType.objects.get_for_model(Site),
+                        scope_type=reference_cache.content_type(Site),
                         scope_id=data['site'].id,
                         description="vlan_grp",
                     )
@@ -609,6 +538,7 @@ class DeviceOnboardingVersioning(Script):
         self.log_success(f"Created new vlans and added to group: VLANGroup: {vlan_group}, VLANs: {blan}:{mgmt}:{guest}")
         
         main_switch = devices[0]
+        phases.start('LAG and mgmt interfaces')
         
         for idx, device in enumerate(devices, start=1): 
             if idx == 1:
@@ -653,6 +583,7 @@ class DeviceOnboardingVersioning(Script):
         main_switch.save()
         self.log_success(f"Primary IPv4 address: {devices[0].primary_ip4.address} on {main_switch.name}")
 
+        phases.start('port allocation')
         blan_user_port = []
         guest_user_port = []
         ap_port = []
@@ -711,6 +642,7 @@ class DeviceOnboardingVersioning(Script):
 
         self.log_success("Updated all interfaces as required....................................")
 
+        phases.start('uplinks')
         lag_int = main_switch.interfaces.get(name=data["lag_name"])
         lag_int.tagged_vlans.add(blan, mgmt, guest)
         lag_int.full_clean()
@@ -735,8 +667,7 @@ class DeviceOnboardingVersioning(Script):
             self.log_success(f"Update uplink 1: {uplink1_int} tagged={list(uplink1_int.tagged_vlans.values_list('vid', flat=True))}")
 
         if data['is_stack_switch'] and (stack_count > 1):
-            new_int = replace_slot_(data["uplink_2"], len(devices))
-            uplink_new = to_one_ended(new_int)
+            uplink_new = member_uplink(data["uplink_2"], len(devices))
             uplink2_int = devices[-1].interfaces.get(name=uplink_new)
         else:
             uplink2_int = devices[-1].interfaces.get(name=data["uplink_2"])
@@ -2,6 +2,7 @@
 # pylint: disable=docstring,line-too-long
 
 
+import json
 from typing import Tuple
 
 from dcim.choices import DeviceStatusChoices
@@ -13,53 +14,20 @@ from dcim.models import (
     DeviceRole,
     DeviceType,
     Interface,
-    InterfaceTemplate,
-    Manufacturer,
     Platform,
     Site,
     VirtualChassis,
 )
 from django.utils.safestring import mark_safe
-from django.contrib.contenttypes.models import ContentType
 from django.utils.text import slugify
 from extras.models import ConfigTemplate
 from extras.scripts import *
 from ipam.models import VLAN, IPAddress, VLANGroup
+from interface_names import member_uplink, with_slot
+from model_capabilities import UplinkChoicesForm
+from onboarding_utils import PhaseRecorder, get_interface_id, reference_cache
 
 
-def get_interface_id(device, int_name: str | InterfaceTemplate) -> int:
-    """ Get the ID of an interface on a device. """
-    if isinstance(int_name, InterfaceTemplate):
-        int_name = int_name.name
-    int_id  = Interface.objects.get(device=device, name=int_name)
-
-    return int_id.id
-
-def to_one_ended(new_int: str) -> str:
-    """Convert an interface name to a one-ended format by replacing the last character with '1'.
-    Args:
-        new_int (str): The original interface name.
-    Returns:
-        str: The modified interface name with the last character replaced by '1'.
-    """
-    return new_int[:-1] + "1"
-
-def replace_slot_(int_name: str | InterfaceTemplate , new_slot: int):
-    """Replace the slot number in an interface name with a new slot number.
-    Args:
-        int_name (str | InterfaceTemplate): The original interface name or template.
-        new_slot (int): The new slot number to replace the old one.
-    Returns:
-        str: The modified interface name with the new slot number.
-    """
-    if isinstance(int_name, InterfaceTemplate):
-        int_name = int_name.name
-    int_name_list = int_name.split('/')
-    new_int = int_name_list[0][:-1]
-    module_num = str(new_slot)
-    int_name_list[0] = new_int + module_num
-    return '/'.join(int_name_list)
-
 def per_switch_with_adding(ap_count: int, num_switches: int) -> Tuple[int,int,int]:
     """Calculate the number of access points (APs) to assign per switch, ensuring an even distribution.
     If the total number of APs is not a multiple of the number of switches, additional APs are added to make it so.
@@ -117,7 +85,7 @@ LAG_CHOICES = (
     ('Po3', 'Po3'),
     )
 
-class DeviceOnboardingVersioning(Script):
+class DeviceOnboardingVersioning(UplinkChoicesForm, Script):
     """
     Script for automated device onboarding in NetBox, supporting stacked switches and dynamic uplink selection.
     Handles device creation, VLAN setup, interface configuration, and cable connections for access switches.
@@ -205,12 +173,8 @@ class DeviceOnboardingVersioning(Script):
         min_value=1,
         max_value=10,
     )
-    uplink_1 = ObjectVar(
-        model= InterfaceTemplate,
-        query_params={
-            "device_type_id" : "$switch_model",
-            "type": ["10gbase-x-sfpp","1000base-x-sfp","25gbase-x-sfp28"]
-        },
+    uplink_1 = ChoiceVar(
+        choices=(),
         description="Uplink Interface drop-down",
         label='Uplink Interface',
     )
@@ -234,12 +198,8 @@ class DeviceOnboardingVersioning(Script):
              "type": ['1000base-t', '10gbase-x-sfpp', '10gbase-t', '25gbase-x-sfp28'],
         }
     )
-    uplink_2 = ObjectVar(
-        model= InterfaceTemplate,
-        query_params={
-            "device_type_id" : "$switch_model",
-            "type": ["10gbase-x-sfpp","1000base-x-sfp","25gbase-x-sfp28"]
-        },
+    uplink_2 = ChoiceVar(
+        choices=(),
         description="Uplink Interface drop-down",
         label='Uplink Interface',
     )
@@ -276,10 +236,17 @@ class DeviceOnboardingVersioning(Script):
     )
     
     def run(self, data, commit):
-        switch_role = DeviceRole.objects.get(name='Access Switch')
-        platform = Platform.objects.get(slug='ios')
-        config_template = ConfigTemplate.objects.get(name='master_temp_acc_v1')
-        tenant = Tenant.objects.get(name="Consulting")
+        with PhaseRecorder() as phases:
+            self.provision(data, phases)
+        self.log_info(f"Onboarding took {phases.count} queries\n\n{phases.table()}")
+        return json.dumps({'device': data['device_name'], 'phases': phases.phases, 'totals': phases.totals()})
+
+    def provision(self, data, phases):
+        phases.start('device create')
+        switch_role = reference_cache.get(DeviceRole, name='Access Switch')
+        platform = reference_cache.get(Platform, slug='ios')
+        config_template = reference_cache.get(ConfigTemplate, name='master_temp_acc_v1')
+        tenant = reference_cache.get(Tenant, name="Consulting")
     
         # Determine stack count: 1 if not stack, or user-specified count if stack
         stack_count = data.get("stack_member_count") if data.get("is_stack_switch") else 1
@@ -312,6 +279,7 @@ class DeviceOnboardingVersioning(Script):
             devices.append(switch)
             self.log_success(f"Created switch: {switch.name} with {switch.interfaces.all().count()} interfaces")
         
+        phases.start('VC build')
         if data['is_stack_switch'] and (stack_count > 1):
             self.log_success(f"Stack creation complete. Total members: {len(devices)}")
             vc = VirtualChassis.objects.create(
@@ -327,19 +295,21 @@ class DeviceOnboardingVersioning(Script):
                     vc.refresh_from_db()
                 device.refresh_from_db()
 
+        phases.start('renumber')
         for idx, device in enumerate(devices, start=1):
             if idx > 1:
                 for intf in device.interfaces.all():
-                    intf.name = replace_slot_(intf.name, idx)
+                    intf.name = with_slot(intf.name, idx)
                     intf.save()
                 
                 device.refresh_from_db()
                 self.log_success(f"Interface name has been updated for stack member {idx}")
 
+        phases.start('VLAN group')
         vlan_group = VLANGroup.objects.create(
                         name=data["device_name"],
                         slug=slugify(data["device_name"]),
-                        scope_type=ContentType.objects.get_for_model(Site),
+                        scope_type=reference_cache.content_type(Site),
                         scope_id=data['site'].id,
                         description="vlan_grp",
                     )
@@ -371,6 +341,7 @@ class DeviceOnboardingVersioning(Script):
         self.log_success(f"Created new vlans and added to group: VLANGroup: {vlan_group}, VLANs: {blan}:{mgmt}:{guest}")
         
         main_switch = devices[0]
+        phases.start('LAG and mgmt interfaces')
         
         for idx, device in enumerate(devices, start=1):
             device.custom_field_data["vlan_group"] = vlan_group.id
@@ -421,6 +392,7 @@ class DeviceOnboardingVersioning(Script):
         main_switch.save()
         self.log_success(f"Primary IPv4 address: {devices[0].primary_ip4.address} on {main_switch.name}")
 
+        phases.start('port allocation')
         blan_user_port = []
         guest_user_port = []
         ap_port = []
@@ -479,6 +451,7 @@ class DeviceOnboardingVersioning(Script):
 
         self.log_success("Updated all interfaces as required....................................")
 
+        phases.start('uplinks')
         lag_int = main_switch.interfaces.get(name=data["lag_name"])
         lag_int.tagged_vlans.add(blan, mgmt, guest)
         lag_int.full_clean()
@@ -503,8 +476,7 @@ class DeviceOnboardingVersioning(Script):
             self.log_success(f"Update uplink 1: {uplink1_int} tagged={list(uplink1_int.tagged_vlans.values_list('vid', flat=True))}")
 
         if data['is_stack_switch'] and (stack_count > 1):
-            new_int = replace_slot_(data["uplink_2"], len(devices))
-            uplink_new = to_one_ended(new_int)
+            uplink_new = member_uplink(data["uplink_2"], len(devices))
             uplink2_int = devices[-1].interfaces.get(name=uplink_new)
         else:
             uplink2_int = devices[-1].interfaces.get(name=data["uplink_2"])
@@ -524,6 +496,7 @@ class DeviceOnboardingVersioning(Script):
         else:
             self.log_success(f"Update uplink 2: {uplink2_int} tagged={list(uplink2_int.tagged_vlans.values_list('vid', flat=True))}")
 
+        phases.start('cabling')
         connections = []
         
         # Cable Connection Side A
@@ -1,115 +1,21 @@
 # pylint: cSpell:disable
 # pylint: disable=docstring,line-too-long
 
+import json
 
-from typing import Tuple
-
-from dcim.choices import DeviceStatusChoices
-from tenancy.models import Tenant
 from dcim.models import (
-    Cable,
-    CableTermination,
     Device,
-    DeviceRole,
     DeviceType,
     Interface,
-    InterfaceTemplate,
-    Manufacturer,
     Platform,
     Site,
-    VirtualChassis,
 )
 from django.utils.safestring import mark_safe
-from django.contrib.contenttypes.models import ContentType
-from django.utils.text import slugify
-from extras.models import ConfigTemplate
 from extras.scripts import *
-from ipam.models import VLAN, IPAddress, VLANGroup
-
-
-def get_interface_id(device, int_name: str | InterfaceTemplate) -> int:
-    """ Get the ID of an interface on a device. """
-    if isinstance(int_name, InterfaceTemplate):
-        int_name = int_name.name
-    int_id  = Interface.objects.get(device=device, name=int_name)
+from model_capabilities import UplinkChoicesForm
+from onboarding_plan import dump_plans, plan_errors, plan_onboarding
+from onboarding_utils import PhaseRecorder, onboard_switch, resolve_references
 
-    return int_id.id
-
-def to_one_ended(new_int: str) -> str:
-    """Convert an interface name to a one-ended format by replacing the last character with '1'.
-    Args:
-        new_int (str): The original interface name.
-    Returns:
-        str: The modified interface name with the last character replaced by '1'.
-    """
-    return new_int[:-1] + "1"
-
-def replace_slot_(int_name: str | InterfaceTemplate , new_slot: int):
-    """Replace the slot number in an interface name with a new slot number.
-    Args:
-        int_name (str | InterfaceTemplate): The original interface name or template.
-        new_slot (int): The new slot number to replace the old one.
-    Returns:
-        str: The modified interface name with the new slot number.
-    """
-    if isinstance(int_name, InterfaceTemplate):
-        int_name = int_name.name
-    int_name_list = int_name.split('/')
-    new_int = int_name_list[0][:-1]
-    module_num = str(new_slot)
-    int_name_list[0] = new_int + module_num
-    return '/'.join(int_name_list)
-
-def per_switch_with_adding(ap_count: int, num_switches: int) -> Tuple[int,int,int]:
-    """Calculate the number of access points (APs) to assign per switch, ensuring an even distribution.
-    If the total number of APs is not a multiple of the number of switches, additional APs are added to make it so.
-    Args:
-        ap_count (int): The total number of access points to be distributed.
-        num_switches (int): The number of switches among which to distribute the APs.
-    Returns:
-        Tuple[int, int, int]: A tuple containing:
-            - The number of APs assigned per switch.
-            - The total number of APs after adding any necessary extra APs.
-            - The number of additional APs added to achieve an even distribution.
-    """
-    if num_switches < 1:
-        raise ValueError("num_switches must be >= 1")
-    # minimal total that is a multiple of num_switches and >= ap_count
-    remainder = ap_count % num_switches
-    added = 0 if remainder == 0 else (num_switches - remainder)
-    total = ap_count + added
-    per_switch = total // num_switches
-    return per_switch, total, added
-
-def add_member_to_vc(device: Device, vc: VirtualChassis, position: int, priority: int):
-    """Add a device as a member to a virtual chassis with specified position and priority."""
-    device.virtual_chassis = vc
-    device.vc_priority = priority
-    device.vc_position = position
-    device.save()
-
-def distribute_items(main_list, ap_count=None, guest_count=None):
-    """
-    Distribute up to ap_count items to ap_list and up to guest_count items to guest_list.
-    Removes assigned items from main_list (returned as a new list).
-    Returns (ap_list, guest_list, main_list).
-    """
-    ap_list = []
-    guest_list = []
-
-    # Assign to ap_list
-    if isinstance(ap_count, int) and ap_count > 0:
-        take_ap = min(ap_count, len(main_list))
-        ap_list = main_list[:take_ap]
-        main_list = main_list[take_ap:]
-
-    # Assign to guest_list (after ap_list has taken its share)
-    if isinstance(guest_count, int) and guest_count > 0:
-        take_guest = min(guest_count, len(main_list))
-        guest_list = main_list[:take_guest]
-        main_list = main_list[take_guest:]
-
-    return main_list, ap_list, guest_list
 
 LAG_CHOICES = (
     ('Po1', 'Po1'),
@@ -117,7 +23,7 @@ LAG_CHOICES = (
     ('Po3', 'Po3'),
     )
 
-class DeviceOnboardingVersioning(Script):
+class DeviceOnboardingVersioning(UplinkChoicesForm, Script):
     """
     Script for automated device onboarding in NetBox, supporting stacked switches and dynamic uplink selection.
     Handles device creation, VLAN setup, interface configuration, and cable connections for access switches.
@@ -134,6 +40,7 @@ class DeviceOnboardingVersioning(Script):
             ('Uplink Ports', ('uplink_1', 'uplink_2')),
             ('Lag Interface', ('lag_name', 'lag_desc')),
             ('Distribution/Leaf Device', ('uplink_sw_a', 'uplink_intf_sw_a', 'uplink_sw_b', 'uplink_intf_sw_b')),
+            ('Execution', ('plan_only',)),
         )
 
     device_name = StringVar(
@@ -209,11 +116,8 @@ class DeviceOnboardingVersioning(Script):
         min_value=1,
         max_value=10,
     )
-    uplink_1 = ObjectVar(
-        model= InterfaceTemplate,
-        query_params={
-            "device_type_id" : "$switch_model",
-        },
+    uplink_1 = ChoiceVar(
+        choices=(),
         description="Uplink Interface drop-down",
         label='Uplink Interface 1',
     )
@@ -232,11 +136,8 @@ class DeviceOnboardingVersioning(Script):
              "type": ['1000base-t', '10gbase-x-sfpp', '10gbase-t', '25gbase-x-sfp28'],
         }
     )
-    uplink_2 = ObjectVar(
-        model= InterfaceTemplate,
-        query_params={
-            "device_type_id" : "$switch_model",
-        },
+    uplink_2 = ChoiceVar(
+        choices=(),
         description="Uplink Interface drop-down",
         required=False,
         label='Uplink Interface 2',
@@ -269,308 +170,17 @@ class DeviceOnboardingVersioning(Script):
         label='Lag Interface Description',
         default='remotehost=os-z07-41ra0043-01-sw-lef-a/b; port=ae18'
     )
-    
-    def run(self, data, commit):
-        switch_role = DeviceRole.objects.get(name='Access Switch')
-        config_template = ConfigTemplate.objects.get(name='master_temp_acc_v1')
-        tenant = Tenant.objects.get(name="Consulting")
-    
-        # Determine stack count: 1 if not stack, or user-specified count if stack
-        stack_count = data.get("stack_member_count") if data.get("is_stack_switch") else 1
-        
-        # Ensure stack_count is at least 1
-        #stack_count = max(1, int(data.get("stack_member_count", 1)))
-
-        devices = []
-        for i in range(1, stack_count + 1):
-            # First device uses device_name, others use device_name + index
-            if i == 1:
-                name = data['device_name']
-            else:
-                name = f"{data['device_name']}{i}"
-                
-            switch = Device.objects.create(
-                device_type=data['switch_model'],
-                name=name,
-                site=data['site'],
-                status=DeviceStatusChoices.STATUS_ACTIVE,
-                role=switch_role,
-                platform=data['platform'],
-                tenant=tenant,
-                config_template=config_template,
-            )
-            switch.custom_field_data["gateway"] = data["gateway_address"]
-            switch.full_clean()
-            switch.save()
-            switch.refresh_from_db()
-            devices.append(switch)
-            self.log_success(f"Created switch: {switch.name} with {switch.interfaces.all().count()} interfaces")
-        
-        if data['is_stack_switch'] and (stack_count > 1):
-            self.log_success(f"Stack creation complete. Total members: {len(devices)}")
-            vc = VirtualChassis.objects.create(
-                name=data['device_name'],
-                description=data['device_name'],
-            )
-            for idx, device in enumerate(devices, start=1):
-                pr = 16 - idx 
-                add_member_to_vc(device, vc, idx, pr)
-                if idx == 1:
-                    vc.master = device
-                    vc.save()
-                    vc.refresh_from_db()
-                device.refresh_from_db()
-
-        for idx, device in enumerate(devices, start=1):
-            if idx > 1:
-                for intf in device.interfaces.all():
-                    intf.name = replace_slot_(intf.name, idx)
-                    intf.save()
-                
-                device.refresh_from_db()
-                self.log_success(f"Interface name has been updated for stack member {idx}")
-
-        vlan_group = VLANGroup.objects.create(
-                        name=data["device_name"],
-                        slug=slugify(data["device_name"]),
-                        scope_type=ContentType.objects.get_for_model(Site),
-                        scope_id=data['site'].id,
-                        description="vlan_grp",
-                    )
-        self.log_success(f"Created new vlan group: {vlan_group}")
-        blan = VLAN.objects.create(
-                        group=vlan_group,
-                        vid=data["blan_vlan"],
-                        name="blan",
-                        status="active",
-                        site=data['site'],
-                        description="Business LAN",
-                    )
-        mgmt = VLAN.objects.create(
-                group=vlan_group,
-                vid=data["mgmt_vlan"],
-                name="mgmt",
-                status="active",
-                site=data['site'],
-                description="Mgmt Vlan",
-            )
-        guest = VLAN.objects.create(
-                group=vlan_group,
-                vid=data["guest_vlan"],
-                name="guest",
-                status="active",
-                site=data['site'],
-                description="Guest Vlan",
-            )
-        self.log_success(f"Created new vlans and added to group: VLANGroup: {vlan_group}, VLANs: {blan}:{mgmt}:{guest}")
-        
-        main_switch = devices[0]
-        
-        for idx, device in enumerate(devices, start=1):
-            device.custom_field_data["vlan_group"] = vlan_group.id
-            device.full_clean()
-            device.save()
-            device.refresh_from_db()
-            
-            if idx == 1:
-                interface_portc = Interface.objects.create(
-                    device=device, 
-                    name=data["lag_name"], 
-                    type="lag", 
-                    description=data["lag_desc"],
-                    mode='tagged'
-                )
-                interface_mgmt = Interface.objects.create(
-                    device=device, 
-                    name=f'vlan{str(data["mgmt_vlan"])}', 
-                    type="virtual", 
-                    description="mgmt interface",
-                )
-                
-                if data['is_stack_switch'] and (stack_count > 1):
-                    self.log_success(f"Created new Po1 and mgmt int vlan: {interface_mgmt}, Portchannel:{interface_portc} on member {idx}")
-                else:
-                    self.log_success(f"Created new Po1 and mgmt int vlan: {interface_mgmt}, Portchannel:{interface_portc}")
-            
-            elif idx == len(devices):            
-                interface_portc = Interface.objects.create(
-                device=device, 
-                name=data["lag_name"], 
-                type="lag", 
-                description=data["lag_desc"],
-                )   
-                self.log_success(f"Created new Po1: Portchannel:{interface_portc} on member {idx}")
-        
-        mgmt_ip = IPAddress.objects.create(
-            address=data['mgmt_address'],
-            status="active",
-            description=data["device_name"],
-        )
-        self.log_success(f"Created IP Address: Mgmt IP: {mgmt_ip}")
-        
-        mgmt_ip.assigned_object = interface_mgmt
-        mgmt_ip.save()
-        
-        main_switch.primary_ip4 = mgmt_ip
-        main_switch.save()
-        self.log_success(f"Primary IPv4 address: {devices[0].primary_ip4.address} on {main_switch.name}")
-
-        blan_user_port = []
-        guest_user_port = []
-        ap_port = []
-        
-        if data['is_stack_switch'] and (stack_count > 1):
-            if data["ap_count"]:
-                ap_count = per_switch_with_adding(data["ap_count"], len(devices))[0]
-            else:
-                ap_count = 0
-            if data["guest_count"]:
-                guest_count = per_switch_with_adding(data["guest_count"], len(devices))[0]  
-            else:
-                guest_count = 0
-        else:
-            ap_count = data["ap_count"]
-            guest_count = data["guest_count"]
-        
-        for idx, device in enumerate(devices, start=1):   
-            usable_int = device.interfaces.filter(name__contains='/0/').reverse()
-            blan_list, ap_list, guest_list = distribute_items(usable_int, ap_count, guest_count)
-            blan_user_port.extend(blan_list)
-            ap_port.extend(ap_list)
-            guest_user_port.extend(guest_list)
-                
-            if data['is_stack_switch'] and (stack_count > 1):
-                self.log_success(f"Port allocation: BLAN ports = {len(blan_list)}, AP ports = {len(ap_list)}, GUEST ports = {len(guest_list)} on stack member {idx}.")
-            else:
-                self.log_success(f"Port allocation: BLAN ports = {len(blan_list)}, AP ports = {len(ap_list)}, GUEST ports = {len(guest_list)}")
-         
-        self.log_success(f"Total ports — BLAN: {len(blan_user_port)}, GUEST: {len(guest_user_port)}, AP: {len(ap_port)}")
-        
-        if ap_port:
-            for idx, ap_int in enumerate(ap_port, start=1):
-                ap_int.mode = "tagged"
-                ap_int.description = f"<<remotehost={main_switch}-wif-0{idx}>>"
-                ap_int.untagged_vlan = blan
-                ap_int.full_clean()
-                ap_int.save()
-                ap_int.tagged_vlans.add(blan,)
-        
-        if blan_user_port:            
-            for b_int in blan_user_port:
-                b_int.mode = "access"
-                b_int.description = "<<remotehost=User>>"
-                b_int.untagged_vlan = blan
-                b_int.full_clean()
-                b_int.save()
-        
-        if guest_user_port:
-            for g_int in guest_user_port:
-                g_int.mode = "access"
-                g_int.description = "<<remotehost=User>>"
-                g_int.untagged_vlan = guest
-                g_int.full_clean()
-                g_int.save()
-
-        self.log_success("Updated all interfaces as required....................................")
-
-        lag_int = main_switch.interfaces.get(name=data["lag_name"])
-        lag_int.tagged_vlans.add(blan, mgmt, guest)
-        lag_int.full_clean()
-        lag_int.save()
-        lag_int.refresh_from_db()
-        self.log_success(f"Update interface Lag: {lag_int}")
-
-        uplink1_int = main_switch.interfaces.get(name=data["uplink_1"])
-        uplink1_int.mode = "tagged"
-        uplink1_int.description = f"<<remotehost={data['uplink_sw_a'].name}; port={data['uplink_intf_sw_a'].name}>>"
-        uplink1_int.lag = main_switch.interfaces.get(name=data["lag_name"])
-        uplink1_int.full_clean()
-        uplink1_int.save()
-        
-        uplink1_int.tagged_vlans.set([blan, mgmt, guest])
-        uplink1_int.save()
-        uplink1_int.refresh_from_db()
-
-        if data['is_stack_switch'] and (stack_count > 1):
-            self.log_success(f"Update uplink 1: {uplink1_int} tagged={list(uplink1_int.tagged_vlans.values_list('vid', flat=True))} on stack member 1")
-        else:
-            self.log_success(f"Update uplink 1: {uplink1_int} tagged={list(uplink1_int.tagged_vlans.values_list('vid', flat=True))}")
-
-        if data["uplink_2"] and data["uplink_intf_sw_b"]:
-            if data['is_stack_switch'] and (stack_count > 1):
-                new_int = replace_slot_(data["uplink_2"], len(devices))
-                uplink_new = to_one_ended(new_int)
-                uplink2_int = devices[-1].interfaces.get(name=uplink_new)
-            else:
-                uplink2_int = devices[-1].interfaces.get(name=data["uplink_2"])
-    
-            uplink2_int.mode = "tagged"
-            uplink2_int.description = f"<<remotehost={data['uplink_sw_b'].name}; port={data['uplink_intf_sw_b'].name}>>"
-            uplink2_int.lag = devices[-1].interfaces.get(name=data["lag_name"])
-            uplink2_int.full_clean()
-            uplink2_int.save()
-            
-            uplink2_int.tagged_vlans.set([blan, mgmt, guest])
-            uplink2_int.save()
-            uplink2_int.refresh_from_db()
-            
-            if data['is_stack_switch'] and (stack_count > 1):
-                self.log_success(f"Update uplink 2: {uplink2_int} tagged={list(uplink2_int.tagged_vlans.values_list('vid', flat=True))} on stack member {len(devices)}")
-            else:
-                self.log_success(f"Update uplink 2: {uplink2_int} tagged={list(uplink2_int.tagged_vlans.values_list('vid', flat=True))}")
-
-        connections = []
-        
-        # Cable Connection Side A
-        uplink_1_id = get_interface_id(main_switch, data['uplink_1'])
-        uplink_intf_sw_a_id = get_interface_id(data['uplink_sw_a'], data['uplink_intf_sw_a'])
-        interface_a = Interface.objects.get(id=uplink_1_id)
-        interface_b = Interface.objects.get(id=uplink_intf_sw_a_id)
-        connect_interfaces_a = (interface_a, interface_b)
-        connections.append(connect_interfaces_a)
+    plan_only = BooleanVar(
+        description="Only compute, validate and show the onboarding plan, and output it as a plan artifact for Apply Onboarding Plans; nothing is written, not even in a dry run",
+        label='Plan Only',
+        default=False,
+    )
 
-        # Cable Connection Side B
-        if data["uplink_2"] and data["uplink_intf_sw_b"]:
-            if data['is_stack_switch'] and (stack_count > 1):
-                uplink_2_id = get_interface_id(devices[-1], uplink2_int)
-            else:
-                uplink_2_id = get_interface_id(main_switch, data['uplink_2'])
-                
-            uplink_intf_sw_b_id = get_interface_id(data['uplink_sw_b'], data['uplink_intf_sw_b'])
-            
-            interface_c = Interface.objects.get(id=uplink_2_id)
-            interface_d = Interface.objects.get(id=uplink_intf_sw_b_id)
-            connect_interfaces_b = (interface_c, interface_d)
-            connections.append(connect_interfaces_b)
-        
-        for connection in connections:
-            cable = Cable(
-                type="smf",
-                label="Uplink to Dis/leaf",
-                status="connected",
-                tenant=tenant,
-                color="00ff00",
-                description="Access SW to Dis/Leaf SW",
-            )
-            cable.save()
-    
-            termination_a = CableTermination(
-                cable=cable,
-                cable_end='A',
-                termination=connection[0],
-            )
-            termination_a.save()
-            termination_b = CableTermination(
-                cable=cable,
-                cable_end='B',
-                termination=connection[1],
-            )
-            termination_b.save()
-            cable._terminations_modified = True
-            cable.full_clean()
-            cable.save()
-            cable.refresh_from_db()
-            self.log_success(f"Cable {cable.label} with id {cable.id} created and connected between {connection[0].name} and {connection[1].name}")
+    def run(self, data, commit):
+        if data.get('plan_only'):
+            return self.show_plan(data)
+        phases = PhaseRecorder()
+        main_switch = onboard_switch(self, data, resolve_references(), phases)
 
         device_name = main_switch.name
         device_url = f"http://localhost:9000/dcim/devices/{main_switch.id}/"
@@ -584,3 +194,19 @@ class DeviceOnboardingVersioning(Script):
             f'  </a>'
             f'</div>'
         ))
+        return json.dumps({
+            'device': device_name,
+            'members': data['stack_member_count'] if data['is_stack_switch'] else 1,
+            'phases': phases.phases,
+            'totals': phases.totals(),
+        })
+
+    def show_plan(self, data):
+        plan = plan_onboarding(data)
+        errors = plan_errors(plan)
+        for error in errors:
+            self.log_failure(error)
+        if not errors:
+            self.log_success(f"Plan is valid: {plan.summary()}")
+        self.log_info(f"Onboarding plan for {plan.main_switch}\n\n{plan.render()}")
+        return dump_plans([plan])
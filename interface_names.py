@@ -0,0 +1,166 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+"""
+Interface name parsing for the onboarding stages and the config templates.
+
+parse() turns a name into an InterfaceName record (type, slot, subslot,
+port, subinterface) and caches the result, so renumbering a 5-member stack
+parses each template name once. Names with three numbers are
+slot/subslot/port (TenGigabitEthernet1/1/4), two numbers slot/port
+(GigabitEthernet1/1) and one number a bare port (Port-channel1, Vlan60).
+
+The batch helpers apply one transform to a whole list of names, and
+abbreviate()/expand() convert between the short forms used in forms and
+CLI output (Te1/1/1) and the full names NetBox stores. JINJA_FILTERS exposes
+the same operations to templates; the render service registers them, and
+for NetBox's own ConfigTemplate rendering they can be added to
+JINJA2_FILTERS in configuration.py.
+"""
+
+import re
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+NAME_RE = re.compile(r'^(?P<type>[A-Za-z][A-Za-z-]*?)(?P<numbers>\d+(?:/\d+)*)(?:\.(?P<sub>\d+))?$')
+
+# (full name, abbreviation); several full names may share an abbreviation, the first one is canonical
+INTERFACE_TYPES = (
+    ('TwentyFiveGigE', 'Twe'),
+    ('TwentyFiveGigabitEthernet', 'Twe'),
+    ('HundredGigE', 'Hu'),
+    ('HundredGigabitEthernet', 'Hu'),
+    ('FortyGigabitEthernet', 'Fo'),
+    ('TenGigabitEthernet', 'Te'),
+    ('FiveGigabitEthernet', 'Fi'),
+    ('TwoGigabitEthernet', 'Tw'),
+    ('AppGigabitEthernet', 'Ap'),
+    ('GigabitEthernet', 'Gi'),
+    ('FastEthernet', 'Fa'),
+    ('Port-channel', 'Po'),
+    ('Vlan', 'Vl'),
+)
+
+ABBREVIATIONS = {full.lower(): short for full, short in INTERFACE_TYPES}
+
+EXPANSIONS = {}
+for _full, _short in INTERFACE_TYPES:
+    EXPANSIONS.setdefault(_short.lower(), _full)
+    EXPANSIONS.setdefault(_full.lower(), _full)
+
+
+class InterfaceName(NamedTuple):
+    """A parsed interface name. Missing levels are None."""
+    type: str
+    slot: Optional[int]
+    subslot: Optional[int]
+    port: Optional[int]
+    subinterface: Optional[int] = None
+
+    @property
+    def numbers(self) -> Tuple[int, ...]:
+        return tuple(number for number in (self.slot, self.subslot, self.port) if number is not None)
+
+    def __str__(self) -> str:
+        name = self.type + '/'.join(str(number) for number in self.numbers)
+        return name if self.subinterface is None else f"{name}.{self.subinterface}"
+
+    def with_slot(self, slot: int) -> 'InterfaceName':
+        """The same port on another slot (stack member). Names without a slot are returned unchanged."""
+        return self if self.slot is None else self._replace(slot=slot)
+
+    def with_port(self, port: int) -> 'InterfaceName':
+        return self._replace(port=port)
+
+
+@lru_cache(maxsize=8192)
+def parse(name: str) -> InterfaceName:
+    """Parse an interface name.
+    Raises:
+        ValueError: If the name has no type prefix followed by a number.
+    """
+    match = NAME_RE.match(name.strip())
+    if not match:
+        raise ValueError(f"Not an interface name: {name!r}")
+    numbers = [int(number) for number in match.group('numbers').split('/')]
+    sub = int(match.group('sub')) if match.group('sub') is not None else None
+    if len(numbers) == 1:
+        return InterfaceName(match.group('type'), None, None, numbers[0], sub)
+    if len(numbers) == 2:
+        return InterfaceName(match.group('type'), numbers[0], None, numbers[1], sub)
+    if len(numbers) == 3:
+        return InterfaceName(match.group('type'), numbers[0], numbers[1], numbers[2], sub)
+    raise ValueError(f"Unsupported interface numbering: {name!r}")
+
+
+def name_of(value) -> str:
+    """Accept an interface name or anything with a .name (Interface, InterfaceTemplate)."""
+    return getattr(value, 'name', value)
+
+
+def with_slot(name, slot: int) -> str:
+    """GigabitEthernet1/0/5, 3 -> GigabitEthernet3/0/5. Names without a slot, or not parseable, are returned unchanged."""
+    name = name_of(name)
+    try:
+        return str(parse(name).with_slot(slot))
+    except ValueError:
+        return name
+
+
+def member_uplink(name, member: int) -> str:
+    """The first port of the same uplink module on another member: TenGigabitEthernet1/1/2, 3 -> TenGigabitEthernet3/1/1."""
+    return str(parse(name_of(name)).with_slot(member).with_port(1))
+
+
+def renumber(names: Iterable, slot: int) -> List[str]:
+    """Move a whole list of names to another slot; member 1 keeps its names."""
+    names = [name_of(name) for name in names]
+    if slot == 1:
+        return names
+    return [with_slot(name, slot) for name in names]
+
+
+def _retype(name, types: dict) -> str:
+    name = name_of(name)
+    try:
+        parsed = parse(name)
+    except ValueError:
+        return name
+    new_type = types.get(parsed.type.lower())
+    return str(parsed._replace(type=new_type)) if new_type else name
+
+
+def abbreviate(name) -> str:
+    """TenGigabitEthernet1/1/1 -> Te1/1/1. Unknown types and unparseable names are returned unchanged."""
+    return _retype(name, ABBREVIATIONS)
+
+
+def expand(name) -> str:
+    """Te1/1/1 or te1/1/1 -> TenGigabitEthernet1/1/1. Unknown types and unparseable names are returned unchanged."""
+    return _retype(name, EXPANSIONS)
+
+
+def abbreviate_all(names: Iterable) -> List[str]:
+    return [abbreviate(name) for name in names]
+
+
+def expand_all(names: Iterable) -> List[str]:
+    return [expand(name) for name in names]
+
+
+def interface_port(name) -> int:
+    """Template filter: the port number, e.g. the channel-group of Port-channel12 or Po12."""
+    return parse(name_of(name)).port
+
+
+def interface_slot(name) -> Optional[int]:
+    """Template filter: the slot (stack member) of a name, None when it has none."""
+    return parse(name_of(name)).slot
+
+
+JINJA_FILTERS = {
+    'interface_abbrev': abbreviate,
+    'interface_expand': expand,
+    'interface_port': interface_port,
+    'interface_slot': interface_slot,
+    'interface_with_slot': with_slot,
+}
@@ -0,0 +1,264 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+"""
+Capability registry for the access switch models.
+
+What the onboarding forms and stages need to know about a model (uplink
+candidates, access port ranges, stack support and maximum stack size) is
+derived from its DeviceType and InterfaceTemplate data, so a new model needs
+nothing but its device type. The registry is built for every device type
+with two queries the first time it is needed, served from memory after
+that, and dropped whenever a DeviceType or InterfaceTemplate is saved or
+deleted.
+
+A model's stack size comes from the DeviceType custom field
+max_stack_members when it is set. Otherwise models with stacking ports
+(interface templates of a stack type) are taken to stack up to
+DEFAULT_MAX_STACK_MEMBERS, and all others not to stack: member/0/port
+numbering alone says nothing, non-stacking models such as the C9200CX use
+it too.
+
+Only models of ACCESS_SWITCH_MANUFACTURERS with access ports are offered
+as access switches; routers, leafs and servers in the same NetBox stay out
+of the drop-downs. CapabilityForm rejects stacks a model does not support
+when the script form is validated; UplinkChoicesForm also fills the uplink
+drop-downs of the onboarding scripts from the registry.
+"""
+
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from dcim.models import DeviceType, InterfaceTemplate
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_delete, post_save
+from interface_names import abbreviate
+from onboarding_utils import build_port_inventory
+
+MAX_STACK_MEMBERS_FIELD = 'max_stack_members'
+
+DEFAULT_MAX_STACK_MEMBERS = 8
+
+# Manufacturer slugs whose models can be onboarded as access switches
+ACCESS_SWITCH_MANUFACTURERS = ('cisco',)
+
+# Uplink choices of the hardcoded per-model table the registry replaced, by device type slug
+LEGACY_UPLINK_CHOICES = {
+    'cisco-c9300l-24p-4x': tuple(f'TenGigabitEthernet1/1/{port}' for port in range(1, 5)),
+    'cisco-c9300l-48uxg-4x': tuple(f'TenGigabitEthernet1/1/{port}' for port in range(1, 5)),
+    'cisco-c9300lm-24u-4y': tuple(f'TwentyFiveGigabitEthernet1/1/{port}' for port in range(1, 5)),
+    'cisco-c9200cx-12p-2x2g': ('GigabitEthernet1/1/1', 'GigabitEthernet1/1/2', 'TenGigabitEthernet1/1/3', 'TenGigabitEthernet1/1/4'),
+    'cisco-ie-4000-8gt8gp4g-e': tuple(f'GigabitEthernet1/{port}' for port in range(1, 5)),
+}
+
+PORT_NUMBER_RE = re.compile(r'^(.*?)(\d+)$')
+
+
+def natural_key(name: str) -> list:
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
+def port_ranges(names) -> Tuple[str, ...]:
+    """Compress interface names into ranges: GigabitEthernet1/0/1..24 -> GigabitEthernet1/0/1-24."""
+    runs = []
+    for name in sorted(names, key=natural_key):
+        match = PORT_NUMBER_RE.match(name)
+        if not match:
+            runs.append([name, None, None])
+            continue
+        prefix, number = match.group(1), int(match.group(2))
+        if runs and runs[-1][0] == prefix and runs[-1][2] == number - 1:
+            runs[-1][2] = number
+        else:
+            runs.append([prefix, number, number])
+    return tuple(
+        prefix if first is None else f"{prefix}{first}" if first == last else f"{prefix}{first}-{last}"
+        for prefix, first, last in runs
+    )
+
+
+class ModelCapabilities(NamedTuple):
+    """What one device type offers the onboarding flow."""
+    device_type_id: int
+    slug: str
+    model: str
+    manufacturer: str
+    uplinks: Tuple[str, ...]
+    access_ports: int
+    access_ranges: Tuple[str, ...]
+    max_members: int
+
+    @property
+    def stackable(self) -> bool:
+        return self.max_members > 1
+
+    @property
+    def access_switch(self) -> bool:
+        return self.manufacturer in ACCESS_SWITCH_MANUFACTURERS and self.access_ports > 0
+
+    def uplink_choices(self) -> Tuple[Tuple[str, str], ...]:
+        return tuple((name, abbreviate(name)) for name in self.uplinks)
+
+
+def model_capabilities(device_type: DeviceType, templates) -> ModelCapabilities:
+    """Derive a device type's capabilities from its interface templates."""
+    inventory = build_port_inventory(templates)
+    max_members = device_type.custom_field_data.get(MAX_STACK_MEMBERS_FIELD)
+    if max_members is None:
+        max_members = DEFAULT_MAX_STACK_MEMBERS if inventory.stack else 1
+    return ModelCapabilities(
+        device_type_id=device_type.pk,
+        slug=device_type.slug,
+        model=device_type.model,
+        manufacturer=device_type.manufacturer.slug,
+        uplinks=inventory.uplink,
+        access_ports=len(inventory.access),
+        access_ranges=port_ranges(inventory.access),
+        max_members=int(max_members),
+    )
+
+
+class CapabilityRegistry:
+    """
+    Process-level ModelCapabilities for every device type with interface templates.
+    The whole registry is built at once and dropped as a whole on any
+    DeviceType or InterfaceTemplate change, or after `ttl` seconds so changes
+    made through another process are picked up.
+    """
+    def __init__(self, ttl: int = 3600):
+        self.ttl = ttl
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def all(self) -> Dict[int, ModelCapabilities]:
+        """Capabilities by device type id."""
+        entry = self._entry
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        templates = defaultdict(list)
+        for template in InterfaceTemplate.objects.filter(device_type__isnull=False).only('device_type_id', 'name', 'type', 'mgmt_only'):
+            templates[template.device_type_id].append(template)
+        registry = {
+            device_type.pk: model_capabilities(device_type, templates[device_type.pk])
+            for device_type in DeviceType.objects.filter(pk__in=list(templates)).select_related('manufacturer').only('pk', 'slug', 'model', 'custom_field_data', 'manufacturer__slug')
+        }
+        with self._lock:
+            self._entry = (registry, time.monotonic() + self.ttl)
+        return registry
+
+    def get(self, device_type) -> Optional[ModelCapabilities]:
+        """Capabilities of one device type (instance or id), or None when it has no interface templates."""
+        return self.all().get(getattr(device_type, 'pk', device_type))
+
+    def access_switches(self) -> List[ModelCapabilities]:
+        return [capabilities for capabilities in self.all().values() if capabilities.access_switch]
+
+    def uplink_choices(self, device_type=None) -> Tuple[Tuple[str, str], ...]:
+        """Uplink choices for one device type, or the union over the access switch models when none is given."""
+        if device_type is not None:
+            capabilities = self.get(device_type)
+            return capabilities.uplink_choices() if capabilities else ()
+        choices = {}
+        for capabilities in self.access_switches():
+            choices.update(capabilities.uplink_choices())
+        return tuple(sorted(choices.items(), key=lambda choice: natural_key(choice[0])))
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entry = None
+
+    def _on_change(self, sender, **kwargs):
+        self.invalidate()
+
+    def connect(self) -> None:
+        """Drop the registry whenever a device type or interface template is saved or deleted."""
+        for model in (DeviceType, InterfaceTemplate):
+            post_save.connect(self._on_change, sender=model)
+            post_delete.connect(self._on_change, sender=model)
+
+
+capability_registry = CapabilityRegistry()
+capability_registry.connect()
+
+
+def capability_errors(device_type, is_stack: bool, members: int = None) -> List[str]:
+    """Check a requested switch or stack against what its model supports."""
+    capabilities = capability_registry.get(device_type)
+    if capabilities is None:
+        return [f"{device_type} has no interface templates"]
+    errors = []
+    if not capabilities.access_switch:
+        errors.append(f"{capabilities.model} is not an access switch model")
+    if is_stack and not capabilities.stackable:
+        errors.append(f"{capabilities.model} does not stack")
+    elif is_stack and members and members > capabilities.max_members:
+        errors.append(f"{capabilities.model} stacks at most {capabilities.max_members} members")
+    return errors
+
+
+def legacy_uplink_errors(capabilities_by_slug: Dict[str, ModelCapabilities]) -> List[str]:
+    """Check that the models of the former hardcoded table still get their old uplink choices.
+    Args:
+        capabilities_by_slug: Capabilities keyed by the LEGACY_UPLINK_CHOICES slug they stand for;
+            slugs without an entry are not checked.
+    Returns:
+        list: One message per model that lost its access ports or one of its old uplinks.
+    """
+    errors = []
+    for slug, uplinks in LEGACY_UPLINK_CHOICES.items():
+        capabilities = capabilities_by_slug.get(slug)
+        if capabilities is None:
+            continue
+        if not capabilities.access_ports:
+            errors.append(f"{slug}: no access ports")
+        missing = [name for name in uplinks if name not in capabilities.uplinks]
+        if missing:
+            errors.append(f"{slug}: uplink choices lost {', '.join(missing)}")
+    return errors
+
+
+class CapabilityForm:
+    """
+    Script mixin: validate the model, stack flag and member count of the
+    submitted form against the capability registry, so an unsupported stack
+    is rejected on the form instead of failing halfway through run().
+    """
+    def as_form(self, data=None, files=None, initial=None):
+        form = super().as_form(data, files, initial)
+        clean = form.clean
+
+        def clean_capabilities():
+            cleaned_data = clean()
+            if cleaned_data.get('switch_model'):
+                errors = capability_errors(cleaned_data['switch_model'], cleaned_data.get('is_stack_switch'), cleaned_data.get('stack_member_count'))
+                if errors:
+                    raise ValidationError(errors)
+            return cleaned_data
+
+        form.clean = clean_capabilities
+        return form
+
+
+def uplink_choices(data=None) -> Tuple[Tuple[str, str], ...]:
+    """Uplink choices for the switch_model of the submitted form data, or for every access switch model before a submit."""
+    device_type = data.get('switch_model') if isinstance(data, dict) else None  # DeviceType instance, pk or None
+    if isinstance(device_type, str):
+        device_type = int(device_type) if device_type.isdigit() else None  # submitted forms carry the pk as a string
+    return capability_registry.uplink_choices(device_type or None)
+
+
+class UplinkChoicesForm(CapabilityForm):
+    """
+    Fill the uplink drop-downs from the capability registry when the form is built.
+    Until a model is submitted they list the access switch models' uplinks;
+    on submit they narrow to the selected model, so an uplink the model does
+    not have is rejected by the form itself, as is an unsupported stack.
+    """
+    def as_form(self, data=None, files=None, initial=None):
+        form = super().as_form(data, files, initial)
+        choices = (('', '---------'),) + uplink_choices(data)
+        for name in ('uplink_1', 'uplink_2'):
+            form.fields[name].choices = choices
+        return form
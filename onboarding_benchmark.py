@@ -0,0 +1,331 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+"""
+Benchmark for the onboarding scripts.
+
+Runs DeviceOnboarding, DeviceOnboardingVersioning (v1/v2/v3) and AddDevices
+against fixture device types for standalone switches and 2/3/5-member stacks,
+and records wall time, DB query count and change-log rows per scenario.
+Every fixture and every onboarded device is created inside a transaction
+that is rolled back, so the benchmark can run against any NetBox database.
+Before measuring, it checks that the fixture models, and any real device
+type of the former hardcoded uplink table, still get their old uplink
+choices from the capability registry.
+
+Results are compared with the baseline in benchmarks/onboarding_baseline.json.
+Query and change-log counts are deterministic and must not grow; wall time
+is allowed a tolerance. A scenario the baseline has no entry for is reported
+like a regression, and a run against an empty baseline fails. Re-run with
+"Write Baseline" after an intended change and commit the updated file so the
+new numbers show up in review. From a shell:
+
+    ./manage.py runscript onboarding_benchmark.OnboardingBenchmark
+"""
+
+import json
+import os
+import statistics
+import time
+
+import AddDevice
+import device_onboarding
+import device_onboarding_v2
+import device_onboarding_v3
+from core.models import ObjectChange, ObjectType
+from dcim.models import Device, DeviceRole, DeviceType, Interface, InterfaceTemplate, Manufacturer, Platform, Site
+from django.db import transaction
+from extras.models import ConfigTemplate, CustomField
+from extras.scripts import *
+from ipam.models import VLANGroup
+from netaddr import IPNetwork
+from model_capabilities import capability_registry, legacy_uplink_errors
+from onboarding_utils import QueryCounter, port_inventory, reference_cache
+from tenancy.models import Tenant
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'onboarding_baseline.json')
+
+STACK_SIZES = (1, 2, 3, 5)
+
+# Port layout of each fixture device type: (name pattern, port numbers, interface type),
+# and the slug of the model it stands for in LEGACY_UPLINK_CHOICES
+FIXTURE_DEVICE_TYPES = {
+    'c9300l-24p-4x': {
+        'model': 'C9300L-24P-4X',
+        'legacy_slug': 'cisco-c9300l-24p-4x',
+        'stackable': True,
+        'ports': (('GigabitEthernet1/0/{}', range(1, 25), '1000base-t'), ('TenGigabitEthernet1/1/{}', range(1, 5), '10gbase-x-sfpp'), ('StackPort1/{}', range(1, 3), 'cisco-stackwise-320')),
+    },
+    'c9300l-48uxg-4x': {
+        'model': 'C9300L-48UXG-4X',
+        'legacy_slug': 'cisco-c9300l-48uxg-4x',
+        'stackable': True,
+        'ports': (('TwoGigabitEthernet1/0/{}', range(1, 37), '2.5gbase-t'), ('TenGigabitEthernet1/0/{}', range(37, 49), '10gbase-t'), ('TenGigabitEthernet1/1/{}', range(1, 5), '10gbase-x-sfpp'), ('StackPort1/{}', range(1, 3), 'cisco-stackwise-320')),
+    },
+    'c9300lm-24u-4y': {
+        'model': 'C9300LM-24U-4Y',
+        'legacy_slug': 'cisco-c9300lm-24u-4y',
+        'stackable': True,
+        'ports': (('GigabitEthernet1/0/{}', range(1, 25), '1000base-t'), ('TwentyFiveGigabitEthernet1/1/{}', range(1, 5), '25gbase-x-sfp28'), ('StackPort1/{}', range(1, 3), 'cisco-stackwise-320')),
+    },
+    'c9200cx': {
+        'model': 'C9200CX-12P-2X2G',
+        'legacy_slug': 'cisco-c9200cx-12p-2x2g',
+        'stackable': False,
+        'ports': (('GigabitEthernet1/0/{}', range(1, 13), '1000base-t'), ('GigabitEthernet1/1/{}', range(1, 3), '1000base-x-sfp'), ('TenGigabitEthernet1/1/{}', range(3, 5), '10gbase-x-sfpp')),
+    },
+    'ie-4000': {
+        'model': 'IE-4000-8GT8GP4G-E',
+        'legacy_slug': 'cisco-ie-4000-8gt8gp4g-e',
+        'stackable': False,
+        'ports': (('GigabitEthernet1/{}', range(1, 5), '1000base-x-sfp'), ('GigabitEthernet1/{}', range(5, 21), '1000base-t')),
+    },
+}
+
+# Uplink port pair used by every scenario on each device type
+FIXTURE_UPLINKS = {
+    'c9300l-24p-4x': ('TenGigabitEthernet1/1/1', 'TenGigabitEthernet1/1/2'),
+    'c9300l-48uxg-4x': ('TenGigabitEthernet1/1/1', 'TenGigabitEthernet1/1/2'),
+    'c9300lm-24u-4y': ('TwentyFiveGigabitEthernet1/1/1', 'TwentyFiveGigabitEthernet1/1/2'),
+    'c9200cx': ('TenGigabitEthernet1/1/3', 'TenGigabitEthernet1/1/4'),
+    'ie-4000': ('GigabitEthernet1/1', 'GigabitEthernet1/2'),
+}
+
+# (label, script module, script class, supports stacks)
+SCRIPTS = (
+    ('DeviceOnboarding', device_onboarding, 'DeviceOnboarding', False),
+    ('Versioning v1', device_onboarding, 'DeviceOnboardingVersioning', True),
+    ('Versioning v2', device_onboarding_v2, 'DeviceOnboardingVersioning', True),
+    ('Versioning v3', device_onboarding_v3, 'DeviceOnboardingVersioning', True),
+    ('AddDevices', AddDevice, 'AddDevices', False),
+)
+
+
+def build_fixtures() -> dict:
+    """Create the device types, site and leafs; fixtures left by an earlier run and the references the scripts look up by name are reused."""
+    manufacturer, _ = Manufacturer.objects.get_or_create(slug='benchmark', defaults={'name': 'Benchmark'})
+    device_types = {}
+    for key, spec in FIXTURE_DEVICE_TYPES.items():
+        device_type, created = DeviceType.objects.get_or_create(manufacturer=manufacturer, slug=f'benchmark-{key}', defaults={'model': spec['model']})
+        if created:
+            InterfaceTemplate.objects.bulk_create([
+                InterfaceTemplate(device_type=device_type, name=pattern.format(port), type=port_type)
+                for pattern, ports, port_type in spec['ports']
+                for port in ports
+            ])
+        device_types[key] = device_type
+
+    site, _ = Site.objects.get_or_create(slug='benchmark-site', defaults={'name': 'Benchmark Site'})
+    role, _ = DeviceRole.objects.get_or_create(name='Access Switch', defaults={'slug': 'benchmark-access-switch'})
+    platform, _ = Platform.objects.get_or_create(slug='ios', defaults={'name': 'Benchmark IOS'})
+    ConfigTemplate.objects.get_or_create(name='master_temp_acc_v1', defaults={'template_code': ''})
+    Tenant.objects.get_or_create(name='Consulting', defaults={'slug': 'benchmark-consulting'})
+    device_object_type = ObjectType.objects.get_for_model(Device)
+    if not CustomField.objects.filter(name='gateway').exists():
+        CustomField.objects.create(name='gateway', type='text').object_types.set([device_object_type])
+    if not CustomField.objects.filter(name='vlan_group').exists():
+        field = CustomField.objects.create(name='vlan_group', type='object', related_object_type=ObjectType.objects.get_for_model(VLANGroup))
+        field.object_types.set([device_object_type])
+
+    leaf_type, created = DeviceType.objects.get_or_create(manufacturer=manufacturer, slug='benchmark-leaf', defaults={'model': 'Leaf'})
+    if created:
+        InterfaceTemplate.objects.bulk_create([
+            InterfaceTemplate(device_type=leaf_type, name=f'xe-0/0/{port}', type='10gbase-x-sfpp') for port in range(4)
+        ])
+    leaf_role, _ = DeviceRole.objects.get_or_create(slug='benchmark-leaf', defaults={'name': 'Benchmark Leaf'})
+    leafs = [
+        Device.objects.get_or_create(name=f'benchmark-leaf-{side}', site=site, defaults={'device_type': leaf_type, 'role': leaf_role})[0]
+        for side in 'ab'
+    ]
+    return {
+        'device_types': device_types,
+        'site': site,
+        'platform': platform,
+        'leafs': leafs,
+        'leaf_ports': [Interface.objects.get(device=leaf, name='xe-0/0/0') for leaf in leafs],
+    }
+
+
+def scenario_data(fixtures: dict, key: str, members: int) -> dict:
+    """Form data for one scenario, shaped like what NetBox hands Script.run()."""
+    uplink_1, uplink_2 = FIXTURE_UPLINKS[key]
+    return {
+        'device_name': 'bench-acc',
+        'switch_model': fixtures['device_types'][key],
+        'site': fixtures['site'],
+        'platform': fixtures['platform'],
+        'mgmt_address': IPNetwork('10.255.0.10/24'),
+        'gateway_address': '10.255.0.1',
+        'is_stack_switch': members > 1,
+        'stack_member_count': members,
+        'mgmt_vlan': 60,
+        'blan_vlan': 100,
+        'guest_vlan': 200,
+        'ap_count': 4,
+        'guest_count': 2,
+        'uplink_1': uplink_1,
+        'uplink_2': uplink_2,
+        'uplink_desc_a': 'remotehost=benchmark-leaf-a; port=xe-0/0/0',
+        'uplink_desc_b': 'remotehost=benchmark-leaf-b; port=xe-0/0/0',
+        'uplink_sw_a': fixtures['leafs'][0],
+        'uplink_intf_sw_a': fixtures['leaf_ports'][0],
+        'uplink_sw_b': fixtures['leafs'][1],
+        'uplink_intf_sw_b': fixtures['leaf_ports'][1],
+        'lag_name': 'Po1',
+        'lag_desc': 'remotehost=benchmark-leaf-a/b; port=ae18',
+    }
+
+
+def reset_caches() -> None:
+    """Drop the process-level caches. Rolled-back fixtures send no post_delete, so they would otherwise stay cached."""
+    reference_cache.invalidate()
+    port_inventory.invalidate()
+    capability_registry.invalidate()
+
+
+def measure(script_class, data: dict) -> dict:
+    """Run one onboarding in a savepoint, roll it back and return its cost."""
+    last_change = ObjectChange.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    savepoint = transaction.savepoint()
+    try:
+        with QueryCounter() as counter:
+            start = time.perf_counter()
+            script_class().run(data, True)
+            seconds = time.perf_counter() - start
+        changes = ObjectChange.objects.filter(pk__gt=last_change).count()
+    finally:
+        transaction.savepoint_rollback(savepoint)
+    return {'seconds': seconds, 'queries': counter.count, 'changes': changes}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """List the scenarios that got worse than the baseline, or that it has no entry for."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            regressions.append(f"{key}: not in the baseline")
+            continue
+        if result['queries'] > base['queries']:
+            regressions.append(f"{key}: {base['queries']} -> {result['queries']} queries")
+        if result['changes'] > base['changes']:
+            regressions.append(f"{key}: {base['changes']} -> {result['changes']} change-log rows")
+        if result['seconds'] > base['seconds'] * (1 + tolerance):
+            regressions.append(f"{key}: {base['seconds']:.3f}s -> {result['seconds']:.3f}s")
+    return regressions
+
+
+class OnboardingBenchmark(Script):
+    """
+    Measure every onboarding script on fixture data and compare with the stored baseline.
+    Nothing is ever committed: fixtures and onboarded devices are rolled back.
+    """
+    class Meta:
+        name = "Onboarding Benchmark"
+        description = "Wall time, query count and change-log rows of the onboarding scripts against a stored baseline"
+        commit_default = False
+        job_timeout = 3600
+        fieldsets = (
+            ('Scenarios', ('scripts', 'device_types', 'iterations')),
+            ('Baseline', ('time_tolerance', 'write_baseline')),
+        )
+
+    scripts = MultipleChoiceVar(
+        choices=[(label, label) for label, *_ in SCRIPTS],
+        required=False,
+        description="Scripts to benchmark (all when empty)",
+    )
+    device_types = MultipleChoiceVar(
+        choices=[(key, spec['model']) for key, spec in FIXTURE_DEVICE_TYPES.items()],
+        required=False,
+        label='Device Types',
+        description="Fixture device types (all when empty)",
+    )
+    iterations = IntegerVar(
+        default=3,
+        min_value=1,
+        max_value=20,
+        description="Runs per scenario; the median wall time is reported",
+    )
+    time_tolerance = IntegerVar(
+        default=50,
+        min_value=0,
+        label='Time Tolerance (%)',
+        description="Wall time increase over the baseline reported as a regression",
+    )
+    write_baseline = BooleanVar(
+        default=False,
+        label='Write Baseline',
+        description="Store these results as the new baseline",
+    )
+
+    def check_capabilities(self, fixtures: dict) -> None:
+        """Fail when a fixture model's stack support is not what it declares, or when a model of the former
+        hardcoded uplink table, fixture or real, lost its old uplink choices."""
+        fixture_capabilities = {
+            spec['legacy_slug']: capability_registry.get(fixtures['device_types'][key])
+            for key, spec in FIXTURE_DEVICE_TYPES.items()
+        }
+        for key, spec in FIXTURE_DEVICE_TYPES.items():
+            capabilities = fixture_capabilities[spec['legacy_slug']]
+            if capabilities is not None and capabilities.stackable != spec['stackable']:
+                self.log_failure(f"Capabilities of fixture {key}: stackable is {capabilities.stackable}, expected {spec['stackable']}")
+        real_capabilities = {capabilities.slug: capabilities for capabilities in capability_registry.all().values()}
+        for source, capabilities in (('fixture', fixture_capabilities), ('device type', real_capabilities)):
+            for error in legacy_uplink_errors({slug: entry for slug, entry in capabilities.items() if entry is not None}):
+                self.log_failure(f"Capabilities of {source} {error}")
+
+    def run(self, data, commit):
+        results = {}
+        with transaction.atomic():
+            fixtures = build_fixtures()
+            self.check_capabilities(fixtures)
+            for label, module, class_name, stacks in SCRIPTS:
+                if data['scripts'] and label not in data['scripts']:
+                    continue
+                script_class = getattr(module, class_name)
+                for key, spec in FIXTURE_DEVICE_TYPES.items():
+                    if data['device_types'] and key not in data['device_types']:
+                        continue
+                    for members in STACK_SIZES if stacks and spec['stackable'] else (1,):
+                        scenario = f"{label} | {key} | {members}"
+                        try:
+                            # Start every scenario from the same warm caches, whichever scenario ran before it
+                            reset_caches()
+                            measure(script_class, scenario_data(fixtures, key, members))
+                            runs = [measure(script_class, scenario_data(fixtures, key, members)) for _ in range(data['iterations'])]
+                        except Exception as exc:
+                            self.log_failure(f"{scenario} failed: {exc}")
+                            continue
+                        results[scenario] = {
+                            'seconds': round(statistics.median(run['seconds'] for run in runs), 4),
+                            'queries': runs[0]['queries'],
+                            'changes': runs[0]['changes'],
+                        }
+            transaction.set_rollback(True)
+        reset_caches()
+
+        baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH) as handle:
+                baseline = json.load(handle)['scenarios']
+        if not baseline:
+            self.log_failure(f"No baseline scenarios in {BASELINE_PATH}; run with Write Baseline and commit the file")
+        else:
+            regressions = compare(results, baseline, data['time_tolerance'] / 100)
+            for regression in regressions:
+                self.log_failure(f"Regression: {regression}")
+            if not regressions:
+                self.log_success(f"{len(results)} scenarios within the baseline")
+
+        if data['write_baseline']:
+            os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+            with open(BASELINE_PATH, 'w') as handle:
+                json.dump({'version': 1, 'scenarios': results}, handle, indent=2, sort_keys=True)
+                handle.write('\n')
+            self.log_success(f"Baseline written to {BASELINE_PATH}")
+
+        lines = [f"{'scenario':<48} {'seconds':>8} {'queries':>8} {'changes':>8} {'base q':>8}"]
+        for scenario, result in results.items():
+            base = baseline.get(scenario, {}).get('queries', '-')
+            lines.append(f"{scenario:<48} {result['seconds']:>8.3f} {result['queries']:>8} {result['changes']:>8} {base:>8}")
+        return '\n'.join(lines)
@@ -0,0 +1,443 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+"""
+In-memory onboarding planner.
+
+A dry run of the onboarding scripts still executes every INSERT/UPDATE before
+the job rolls back, so it costs as much as a real run and holds the same locks.
+plan_onboarding() instead derives the complete result of onboard_switch() from
+the device type's port inventory: devices and VC positions, renamed
+member interfaces, VLAN group and VLANs, LAG/mgmt interfaces, port roles,
+uplink LAG membership and cables. validate_onboarding_plan() checks it against
+the database with a handful of reads, and OnboardingPlan.render() prints it as
+a diff. Nothing is written.
+
+Plans serialise to one compact JSON object per line (dump_plans/load_plans),
+so they can be computed off-peak, reviewed and stored, and later applied by
+apply_onboarding_plan() in a short window.
+"""
+
+import json
+from typing import List
+
+from core.choices import ObjectChangeActionChoices
+from dcim.choices import DeviceStatusChoices
+from dcim.models import Device, DeviceType, Interface, Platform, Site, VirtualChassis
+from django.core.exceptions import ValidationError
+from django.utils.text import slugify
+from interface_names import member_uplink
+from ipam.models import VLAN, IPAddress, VLANGroup
+from model_capabilities import capability_registry
+from netaddr import IPNetwork
+from onboarding_utils import (
+    InterfaceIndex,
+    PhaseRecorder,
+    PortAssignment,
+    UnitOfWork,
+    add_member_to_vc,
+    apply_port_plan,
+    connect_uplinks,
+    distribute_items,
+    per_switch_with_adding,
+    port_inventory,
+    record_bulk_changes,
+    reference_cache,
+    renumber_stack_members,
+    validate_port_plan,
+)
+
+PLAN_VERSION = 1
+
+# Form fields a plan is computed from. Object fields are stored by primary key.
+PLAN_INPUTS = (
+    'device_name', 'mgmt_address', 'gateway_address', 'is_stack_switch', 'stack_member_count',
+    'mgmt_vlan', 'blan_vlan', 'guest_vlan', 'ap_count', 'guest_count', 'uplink_1', 'uplink_2', 'lag_name', 'lag_desc',
+)
+PLAN_REFERENCES = {
+    'switch_model': DeviceType,
+    'site': Site,
+    'platform': Platform,
+    'uplink_sw_a': Device,
+    'uplink_intf_sw_a': Interface,
+    'uplink_sw_b': Device,
+    'uplink_intf_sw_b': Interface,
+}
+
+# Plan sections carried in the artifact, in the order apply_onboarding_plan() creates them
+PLAN_SECTIONS = ('devices', 'virtual_chassis', 'renames', 'vlan_group', 'vlans', 'interfaces', 'mgmt_ip', 'ports', 'uplinks', 'cables')
+
+
+class OnboardingPlan:
+    """
+    Everything one onboarding run would create or change, as plain values.
+    Devices and interfaces are referred to by name, VLANs by their role
+    name (blan/mgmt/guest), so the plan can be rendered and compared
+    without any database objects behind it.
+    """
+    def __init__(self, data: dict):
+        self.data = data
+        self.devices = []        # {'name', 'vc_position', 'vc_priority'}
+        self.virtual_chassis = None
+        self.renames = []        # (device, old name, new name)
+        self.vlan_group = None   # {'name', 'slug'}
+        self.vlans = []          # {'name', 'vid', 'description'}
+        self.interfaces = []     # created: {'device', 'name', 'type', 'description', 'mode', 'tagged_vlans'}
+        self.mgmt_ip = None      # {'address', 'device', 'interface'}
+        self.ports = []          # {'device', 'interface', 'mode', 'description', 'untagged_vlan', 'tagged_vlans'}
+        self.uplinks = []        # {'device', 'interface', 'lag', 'description', 'tagged_vlans'}
+        self.cables = []         # {'a_device', 'a_interface', 'b_device', 'b_interface'}
+        self.member_interfaces = {}  # device name -> interface names after renumbering
+
+    @property
+    def main_switch(self) -> str:
+        return self.devices[0]['name']
+
+    def render(self) -> str:
+        """Render the plan as a diff: + for objects created, ~ for objects changed."""
+        data = self.data
+        lines = []
+        for device in self.devices:
+            position = f", VC position {device['vc_position']} priority {device['vc_priority']}" if self.virtual_chassis else ''
+            lines.append(f"+ dcim.device        {device['name']} ({data['switch_model']}, site {data['site']}{position})")
+        if self.virtual_chassis:
+            lines.append(f"+ dcim.virtualchassis {self.virtual_chassis['name']} master={self.virtual_chassis['master']}")
+        for device, old, new in self.renames:
+            lines.append(f"~ dcim.interface     {device} {old} -> {new}")
+        lines.append(f"+ ipam.vlangroup     {self.vlan_group['name']} (slug {self.vlan_group['slug']})")
+        for vlan in self.vlans:
+            lines.append(f"+ ipam.vlan          {vlan['vid']} {vlan['name']} ({vlan['description']})")
+        for intf in self.interfaces:
+            lines.append(f"+ dcim.interface     {intf['device']} {intf['name']} ({intf['type']}{', mode=' + intf['mode'] if intf['mode'] else ''}{', tagged=' + ','.join(intf['tagged_vlans']) if intf['tagged_vlans'] else ''})")
+        lines.append(f"+ ipam.ipaddress     {self.mgmt_ip['address']} on {self.mgmt_ip['device']} {self.mgmt_ip['interface']} (primary IPv4)")
+        for port in self.ports:
+            tagged = f" tagged={','.join(port['tagged_vlans'])}" if port['tagged_vlans'] else ''
+            lines.append(f"~ dcim.interface     {port['device']} {port['interface']} mode={port['mode']} untagged={port['untagged_vlan']}{tagged} description=\"{port['description']}\"")
+        for uplink in self.uplinks:
+            lines.append(f"~ dcim.interface     {uplink['device']} {uplink['interface']} mode=tagged lag={uplink['lag']} tagged={','.join(uplink['tagged_vlans'])} description=\"{uplink['description']}\"")
+        for cable in self.cables:
+            lines.append(f"+ dcim.cable         {cable['a_device']} {cable['a_interface']} <-> {cable['b_device']} {cable['b_interface']}")
+        return '\n'.join(lines)
+
+    def to_dict(self) -> dict:
+        """The plan as JSON-serialisable values: its inputs, with objects by primary key, and every section."""
+        inputs = {key: self.data.get(key) for key in PLAN_INPUTS}
+        inputs['mgmt_address'] = str(inputs['mgmt_address'])
+        for key in PLAN_REFERENCES:
+            inputs[key] = self.data[key].pk if self.data.get(key) is not None else None
+        payload = {'version': PLAN_VERSION, 'inputs': inputs}
+        payload.update((section, getattr(self, section)) for section in PLAN_SECTIONS)
+        return payload
+
+    @classmethod
+    def from_dict(cls, payload: dict) -> 'OnboardingPlan':
+        """Rebuild a plan from to_dict() output, resolving its referenced objects.
+        Raises:
+            ValidationError: If the artifact has another version or a referenced object no longer exists.
+        """
+        if payload.get('version') != PLAN_VERSION:
+            raise ValidationError(f"Unsupported plan version {payload.get('version')} (expected {PLAN_VERSION})")
+        data = dict(payload['inputs'])
+        data['mgmt_address'] = IPNetwork(data['mgmt_address'])
+        for key, model in PLAN_REFERENCES.items():
+            if data[key] is None:
+                continue
+            try:
+                data[key] = model.objects.get(pk=data[key])
+            except model.DoesNotExist:
+                raise ValidationError(f"{key}: {model._meta.verbose_name} {data[key]} no longer exists") from None
+        plan = cls(data)
+        for section in PLAN_SECTIONS:
+            setattr(plan, section, payload[section])
+        plan.renames = [tuple(rename) for rename in plan.renames]
+        return plan
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.devices)} device(s), {len(self.renames)} renamed interfaces, {len(self.vlans)} VLANs, "
+            f"{len(self.ports)} access ports, {len(self.uplinks)} uplinks, {len(self.cables)} cables"
+        )
+
+
+def plan_onboarding(data: dict) -> OnboardingPlan:
+    """Compute what onboard_switch() would do for this form data, from the device type's port inventory alone.
+    Args:
+        data (dict): The DeviceOnboardingVersioning form data, or an equivalent manifest row.
+    Returns:
+        OnboardingPlan: The complete plan, not yet validated.
+    """
+    plan = OnboardingPlan(data)
+    stack_count = data.get("stack_member_count") if data.get("is_stack_switch") else 1
+    is_stack = bool(data['is_stack_switch'] and stack_count > 1)
+    inventory = port_inventory.get(data['switch_model'])
+
+    for position in range(1, stack_count + 1):
+        name = data['device_name'] if position == 1 else f"{data['device_name']}{position}"
+        plan.devices.append({'name': name, 'vc_position': position, 'vc_priority': 16 - position})
+        names = inventory.for_member(position, inventory.names)
+        plan.renames.extend((name, old, new) for old, new in zip(inventory.names, names) if old != new)
+        plan.member_interfaces[name] = names
+    if is_stack:
+        plan.virtual_chassis = {'name': data['device_name'], 'master': plan.main_switch}
+
+    plan.vlan_group = {'name': data['device_name'], 'slug': slugify(data['device_name'])}
+    plan.vlans = [
+        {'name': 'blan', 'vid': data['blan_vlan'], 'description': 'Business LAN'},
+        {'name': 'mgmt', 'vid': data['mgmt_vlan'], 'description': 'Mgmt Vlan'},
+        {'name': 'guest', 'vid': data['guest_vlan'], 'description': 'Guest Vlan'},
+    ]
+    trunk = ['blan', 'mgmt', 'guest']
+    last = plan.devices[-1]['name']
+    mgmt_interface = f'vlan{data["mgmt_vlan"]}'
+    plan.interfaces.append({'device': plan.main_switch, 'name': data['lag_name'], 'type': 'lag', 'description': data['lag_desc'], 'mode': 'tagged', 'tagged_vlans': trunk})
+    plan.interfaces.append({'device': plan.main_switch, 'name': mgmt_interface, 'type': 'virtual', 'description': 'mgmt interface', 'mode': None, 'tagged_vlans': []})
+    if last != plan.main_switch:
+        plan.interfaces.append({'device': last, 'name': data['lag_name'], 'type': 'lag', 'description': data['lag_desc'], 'mode': None, 'tagged_vlans': []})
+    plan.mgmt_ip = {'address': str(data['mgmt_address']), 'device': plan.main_switch, 'interface': mgmt_interface}
+
+    if is_stack:
+        ap_count = per_switch_with_adding(data["ap_count"], stack_count)[0] if data["ap_count"] else 0
+        guest_count = per_switch_with_adding(data["guest_count"], stack_count)[0] if data["guest_count"] else 0
+    else:
+        ap_count = data["ap_count"]
+        guest_count = data["guest_count"]
+    ap_ports, blan_ports, guest_ports = [], [], []
+    for device in plan.devices:
+        usable = inventory.for_member(device['vc_position'], inventory.access)
+        blan_list, ap_list, guest_list = distribute_items(usable, ap_count, guest_count)
+        blan_ports.extend((device['name'], name) for name in blan_list)
+        ap_ports.extend((device['name'], name) for name in ap_list)
+        guest_ports.extend((device['name'], name) for name in guest_list)
+    for idx, (device, name) in enumerate(ap_ports, start=1):
+        plan.ports.append({'device': device, 'interface': name, 'mode': 'tagged', 'description': f"<<remotehost={plan.main_switch}-wif-0{idx}>>", 'untagged_vlan': 'blan', 'tagged_vlans': ['blan']})
+    for device, name in blan_ports:
+        plan.ports.append({'device': device, 'interface': name, 'mode': 'access', 'description': "<<remotehost=User>>", 'untagged_vlan': 'blan', 'tagged_vlans': []})
+    for device, name in guest_ports:
+        plan.ports.append({'device': device, 'interface': name, 'mode': 'access', 'description': "<<remotehost=User>>", 'untagged_vlan': 'guest', 'tagged_vlans': []})
+
+    uplink_1 = data['uplink_1']
+    plan.uplinks.append({
+        'device': plan.main_switch,
+        'interface': uplink_1,
+        'lag': data['lag_name'],
+        'description': f"<<remotehost={data['uplink_sw_a'].name}; port={data['uplink_intf_sw_a'].name}>>",
+        'tagged_vlans': trunk,
+    })
+    plan.cables.append({'a_device': plan.main_switch, 'a_interface': uplink_1, 'b_device': data['uplink_sw_a'].name, 'b_interface': data['uplink_intf_sw_a'].name})
+    if data["uplink_2"] and data["uplink_intf_sw_b"]:
+        uplink_2 = member_uplink(data["uplink_2"], stack_count) if is_stack else data['uplink_2']
+        plan.uplinks.append({
+            'device': last,
+            'interface': uplink_2,
+            'lag': data['lag_name'],
+            'description': f"<<remotehost={data['uplink_sw_b'].name}; port={data['uplink_intf_sw_b'].name}>>",
+            'tagged_vlans': trunk,
+        })
+        plan.cables.append({'a_device': last, 'a_interface': uplink_2, 'b_device': data['uplink_sw_b'].name, 'b_interface': data['uplink_intf_sw_b'].name})
+    return plan
+
+
+def validate_onboarding_plan(plan: OnboardingPlan) -> None:
+    """Check a plan against itself and the current database, using reads only.
+    Covers the conflicts that would make the real run fail part-way: a stack
+    larger than the model supports, existing device names, VLAN group slug,
+    management address and cabled leaf ports, rename collisions, duplicate
+    VIDs, and interfaces the plan refers to that the device type does not have.
+    Args:
+        plan (OnboardingPlan): A plan built by plan_onboarding().
+    Raises:
+        ValidationError: Listing every problem found.
+    """
+    data = plan.data
+    errors = []
+    capabilities = capability_registry.get(data['switch_model'])
+    if capabilities and len(plan.devices) > capabilities.max_members:
+        errors.append(f"{capabilities.model} stacks at most {capabilities.max_members} member(s), the plan has {len(plan.devices)}")
+    names = [device['name'] for device in plan.devices]
+    for name in Device.objects.filter(site=data['site'], name__in=names).values_list('name', flat=True):
+        errors.append(f"Device {name} already exists in site {data['site']}")
+    if VLANGroup.objects.filter(scope_type=reference_cache.content_type(Site), scope_id=data['site'].pk, slug=plan.vlan_group['slug']).exists():
+        errors.append(f"VLAN group {plan.vlan_group['slug']} already exists in site {data['site']}")
+    if IPAddress.objects.filter(address=plan.mgmt_ip['address']).exists():
+        errors.append(f"IP address {plan.mgmt_ip['address']} already exists")
+
+    vids = [vlan['vid'] for vlan in plan.vlans]
+    if len(set(vids)) != len(vids):
+        errors.append(f"VLAN IDs must be distinct: {vids}")
+    for vlan in plan.vlans:
+        if not 1 <= (vlan['vid'] or 0) <= 4094:
+            errors.append(f"VLAN {vlan['name']}: VID {vlan['vid']} is outside 1-4094")
+
+    for device, interfaces in plan.member_interfaces.items():
+        if len(set(interfaces)) != len(interfaces):
+            errors.append(f"{device}: renumbering produces duplicate interface names")
+    created = {(intf['device'], intf['name']) for intf in plan.interfaces}
+    for device, name in created:
+        if name in plan.member_interfaces[device]:
+            errors.append(f"{device}: {name} already exists on the device type")
+    for uplink in plan.uplinks:
+        if uplink['interface'] not in plan.member_interfaces[uplink['device']]:
+            errors.append(f"{uplink['device']}: uplink {uplink['interface']} does not exist on {data['switch_model']}")
+    port_names = [(port['device'], port['interface']) for port in plan.ports]
+    uplink_names = {(uplink['device'], uplink['interface']) for uplink in plan.uplinks}
+    if len(set(port_names)) != len(port_names) or uplink_names & set(port_names):
+        errors.append("An interface is allocated to more than one port role")
+
+    leaf_ports = [data['uplink_intf_sw_a'], data['uplink_intf_sw_b']] if data.get('uplink_intf_sw_b') else [data['uplink_intf_sw_a']]
+    for intf in Interface.objects.filter(pk__in=[port.pk for port in leaf_ports], cable__isnull=False).select_related('device'):
+        errors.append(f"Leaf interface {intf.device.name} {intf.name} is already cabled")
+    if errors:
+        raise ValidationError(errors)
+
+
+def plan_errors(plan: OnboardingPlan) -> List[str]:
+    """Validation messages for a plan, or an empty list when it is valid."""
+    try:
+        validate_onboarding_plan(plan)
+    except ValidationError as exc:
+        return exc.messages
+    return []
+
+
+def dump_plans(plans: List[OnboardingPlan]) -> str:
+    """Serialise plans as JSON lines, one compact object per plan."""
+    return '\n'.join(json.dumps(plan.to_dict(), separators=(',', ':')) for plan in plans)
+
+
+def load_plans(text: str) -> List[OnboardingPlan]:
+    """Parse the output of dump_plans() back into plans, skipping blank lines."""
+    return [OnboardingPlan.from_dict(json.loads(line)) for line in text.splitlines() if line.strip()]
+
+
+def apply_onboarding_plan(script, plan: OnboardingPlan, refs: dict, phases: PhaseRecorder = None, cable_paths: list = None):
+    """Provision exactly what a stored plan describes.
+    The plan is first recomputed from its inputs: if the device type's
+    templates changed since it was made, the stored plan is stale and is
+    rejected rather than half-applied. It is then validated against the
+    current database and created in dependency order, with the same stages
+    onboard_switch() uses. Interfaces and VLANs are looked up from the plan by
+    name after one load instead of one query per lookup.
+    Args:
+        script (Script): The running script, used for job log output.
+        plan (OnboardingPlan): A plan from plan_onboarding() or load_plans().
+        refs (dict): Reference objects returned by resolve_references().
+        phases (PhaseRecorder): Receives the per-phase timings; a private one is used when omitted.
+        cable_paths (list): Collects the uplink endpoints for a later trace_cable_paths(); paths are traced here when omitted.
+    Returns:
+        Device: The standalone switch or stack master.
+    Raises:
+        ValidationError: If the plan is stale or no longer valid.
+    """
+    # Re-read the templates rather than trust this process's inventory cache
+    port_inventory.invalidate(plan.data['switch_model'].pk)
+    current = plan_onboarding(plan.data)
+    if current.to_dict() != plan.to_dict():
+        raise ValidationError(f"The plan for {plan.data['device_name']} is stale: {plan.data['switch_model']} changed since it was computed")
+    validate_onboarding_plan(current)
+    data = plan.data
+    phases = phases or PhaseRecorder()
+    with phases:
+        uow = UnitOfWork()
+
+        phases.start('device create')
+        devices = []
+        for entry in plan.devices:
+            device = Device(
+                device_type=data['switch_model'],
+                name=entry['name'],
+                site=data['site'],
+                status=DeviceStatusChoices.STATUS_ACTIVE,
+                role=refs['role'],
+                platform=data['platform'],
+                tenant=refs['tenant'],
+                config_template=refs['config_template'],
+            )
+            device.custom_field_data["gateway"] = data["gateway_address"]
+            device.full_clean()
+            # save() instantiates the device type's components, so devices are not bulk created
+            device.save()
+            devices.append(device)
+        by_name = {device.name: device for device in devices}
+        main_switch = devices[0]
+
+        phases.start('VC build')
+        if plan.virtual_chassis:
+            vc = VirtualChassis.objects.create(name=plan.virtual_chassis['name'], description=plan.virtual_chassis['name'])
+            for entry, device in zip(plan.devices, devices):
+                add_member_to_vc(uow, device, vc, entry['vc_position'], entry['vc_priority'])
+            uow.set(vc, master=by_name[plan.virtual_chassis['master']])
+
+        phases.start('renumber')
+        renumber_stack_members(devices)
+
+        phases.start('VLAN group')
+        vlan_group = VLANGroup.objects.create(
+            name=plan.vlan_group['name'],
+            slug=plan.vlan_group['slug'],
+            scope_type=reference_cache.content_type(Site),
+            scope_id=data['site'].id,
+            description="vlan_grp",
+        )
+        vlans = {}
+        for entry in plan.vlans:
+            vlan = VLAN(group=vlan_group, vid=entry['vid'], name=entry['name'], status="active", site=data['site'], description=entry['description'])
+            vlan.full_clean()
+            vlans[entry['name']] = vlan
+        VLAN.objects.bulk_create(vlans.values())
+        record_bulk_changes(((vlan, {}, {'vid': vlan.vid, 'name': vlan.name, 'group': vlan_group.pk}) for vlan in vlans.values()), ObjectChangeActionChoices.ACTION_CREATE)
+
+        phases.start('LAG and mgmt interfaces')
+        for device in devices:
+            uow.set_custom_field(device, "vlan_group", vlan_group.id)
+        created = {}
+        for entry in plan.interfaces:
+            created[(entry['device'], entry['name'])] = Interface.objects.create(
+                device=by_name[entry['device']],
+                name=entry['name'],
+                type=entry['type'],
+                description=entry['description'],
+                mode=entry['mode'],
+            )
+        mgmt_ip = IPAddress.objects.create(
+            address=plan.mgmt_ip['address'],
+            status="active",
+            description=data["device_name"],
+            assigned_object=created[(plan.mgmt_ip['device'], plan.mgmt_ip['interface'])],
+        )
+        uow.set(by_name[plan.mgmt_ip['device']], primary_ip4=mgmt_ip)
+
+        phases.start('port allocation')
+        # One load of every member interface, after renumbering, serves the port plan, the uplinks and the cables
+        interfaces = InterfaceIndex().load(devices)
+        for leaf, peer in ((data['uplink_sw_a'], data['uplink_intf_sw_a']), (data['uplink_sw_b'], data['uplink_intf_sw_b'])):
+            if peer is not None:
+                by_name[leaf.name] = leaf
+                interfaces.add(peer)
+        port_plan = [
+            PortAssignment(interfaces.get(by_name[entry['device']], entry['interface']), entry['mode'], entry['description'], vlans[entry['untagged_vlan']], tuple(vlans[name] for name in entry['tagged_vlans']))
+            for entry in plan.ports
+        ]
+        validate_port_plan(port_plan, data['site'])
+        updated, tagged_rows = apply_port_plan(port_plan)
+        script.log_success(f"Port plan applied: {updated} interfaces updated, {tagged_rows} tagged VLAN assignments")
+
+        phases.start('uplinks')
+        for entry in plan.interfaces:
+            if entry['tagged_vlans']:
+                interfaces.get(by_name[entry['device']], entry['name']).tagged_vlans.add(*(vlans[name] for name in entry['tagged_vlans']))
+        for entry in plan.uplinks:
+            device = by_name[entry['device']]
+            intf = interfaces.get(device, entry['interface'])
+            uow.set(intf, mode="tagged", description=entry['description'], lag=interfaces.get(device, entry['lag']))
+            intf.tagged_vlans.set([vlans[name] for name in entry['tagged_vlans']])
+
+        phases.start('flush')
+        flushed = uow.flush()
+
+        phases.start('cabling')
+        connections = [
+            (interfaces.get(by_name[cable['a_device']], cable['a_interface']), interfaces.get(by_name[cable['b_device']], cable['b_interface']))
+            for cable in plan.cables
+        ]
+        connect_uplinks(script, connections, refs['tenant'], cable_paths)
+    script.log_info(f"Applied plan for {main_switch.name}: {plan.summary()} in {phases.count} queries ({flushed} objects flushed once by the unit of work)\n\n{phases.table()}")
+    return main_switch
@@ -0,0 +1,945 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+"""
+Shared provisioning stages for the access switch onboarding scripts.
+
+This module holds no Script classes, so NetBox lists nothing for it; the
+onboarding scripts import the stages they need from here.
+"""
+
+import string
+import threading
+import time
+from collections import defaultdict
+from typing import Iterable, List, NamedTuple, Tuple
+
+from core.choices import ObjectChangeActionChoices
+from core.models import ObjectChange
+from dcim.choices import DeviceStatusChoices, InterfaceModeChoices
+from dcim.models import (
+    Cable,
+    CableTermination,
+    Device,
+    DeviceRole,
+    DeviceType,
+    Interface,
+    InterfaceTemplate,
+    Platform,
+    Site,
+    VirtualChassis,
+)
+from dcim.utils import create_cablepath
+from django import db
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from django.utils.text import slugify
+from extras.models import ConfigTemplate
+from interface_names import member_uplink, name_of, renumber
+from ipam.models import VLAN, IPAddress, VLANGroup
+from netbox.context import current_request
+from tenancy.models import Tenant
+from utilities.conversion import to_meters
+from utilities.ordering import naturalize_interface
+
+
+class ReferenceCache:
+    """
+    Process-level cache for the reference objects every onboarding run looks up.
+    Entries expire after `ttl` seconds; saving or deleting an instance of a
+    connected model drops that model's entries at once, so an edit in the UI
+    is picked up by the next run in this process.
+    """
+    def __init__(self, ttl: int = 300):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, model, **lookup):
+        """Return model.objects.get(**lookup), served from the cache while the entry is fresh."""
+        key = (model._meta.label_lower, tuple(sorted(lookup.items())))
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        obj = model.objects.get(**lookup)
+        with self._lock:
+            self._entries[key] = (obj, time.monotonic() + self.ttl)
+        return obj
+
+    def content_type(self, model) -> ContentType:
+        """Return the ContentType for a model; Django already caches these per process."""
+        return ContentType.objects.get_for_model(model)
+
+    def invalidate(self, model=None) -> None:
+        """Drop the entries for one model, or every entry when no model is given."""
+        with self._lock:
+            if model is None:
+                self._entries.clear()
+            else:
+                label = model._meta.label_lower
+                self._entries = {key: entry for key, entry in self._entries.items() if key[0] != label}
+
+    def _on_change(self, sender, **kwargs):
+        self.invalidate(sender)
+
+    def connect(self, *models) -> None:
+        """Invalidate a model's entries whenever one of its instances is saved or deleted."""
+        for model in models:
+            post_save.connect(self._on_change, sender=model)
+            post_delete.connect(self._on_change, sender=model)
+
+
+reference_cache = ReferenceCache()
+reference_cache.connect(DeviceRole, Platform, ConfigTemplate, Tenant)
+
+
+class QueryCounter:
+    """Count the SQL statements, and the rows they write, run on the current connection inside a with-block."""
+    def __init__(self):
+        self.count = 0
+        self.rows = 0
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        result = execute(sql, params, many, context)
+        if sql.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+            self.rows += max(context['cursor'].rowcount, 0)
+        return result
+
+    def __enter__(self):
+        self._wrapper = db.connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+
+class PhaseRecorder(QueryCounter):
+    """
+    Split a run into named, consecutive phases and record each one's wall time,
+    query count and rows written. start() closes the running phase and opens
+    the next; leaving the with-block closes the last one.
+    """
+    def __init__(self):
+        super().__init__()
+        self.phases = []
+        self._current = None
+
+    def start(self, name: str) -> None:
+        now = time.perf_counter()
+        self._close(now)
+        self._current = (name, now, self.count, self.rows)
+
+    def _close(self, now: float) -> None:
+        if self._current is None:
+            return
+        name, started, count, rows = self._current
+        self.phases.append({
+            'phase': name,
+            'seconds': round(now - started, 4),
+            'queries': self.count - count,
+            'rows': self.rows - rows,
+        })
+        self._current = None
+
+    def __exit__(self, *exc_info):
+        self._close(time.perf_counter())
+        super().__exit__(*exc_info)
+
+    def totals(self) -> dict:
+        return {
+            'seconds': round(sum(phase['seconds'] for phase in self.phases), 4),
+            'queries': sum(phase['queries'] for phase in self.phases),
+            'rows': sum(phase['rows'] for phase in self.phases),
+        }
+
+    def table(self) -> str:
+        """Markdown table of the phases, for the job log."""
+        lines = ['| Phase | Seconds | Queries | Rows written |', '|---|---:|---:|---:|']
+        for phase in self.phases + [{'phase': '**total**', **self.totals()}]:
+            lines.append(f"| {phase['phase']} | {phase['seconds']:.3f} | {phase['queries']} | {phase['rows']} |")
+        return '\n'.join(lines)
+
+
+class UnitOfWork:
+    """
+    Collect field changes on existing Device/Interface/VirtualChassis objects
+    during a run and save each object once, with only the changed fields.
+    Objects are flushed in the order they were first touched.
+    """
+    def __init__(self):
+        self._dirty = {}
+
+    def _track(self, obj, field: str) -> None:
+        key = (obj._meta.label_lower, obj.pk)
+        self._dirty.setdefault(key, (obj, set()))[1].add(field)
+
+    def set(self, obj, **fields) -> None:
+        """Assign field values on obj and mark them dirty."""
+        for name, value in fields.items():
+            setattr(obj, name, value)
+            self._track(obj, name)
+
+    def set_custom_field(self, obj, name: str, value) -> None:
+        """Assign a custom field value on obj and mark custom_field_data dirty."""
+        obj.custom_field_data[name] = value
+        self._track(obj, 'custom_field_data')
+
+    def flush(self, validate: bool = True) -> int:
+        """Validate and save every dirty object once; return the number of objects saved."""
+        for obj, fields in self._dirty.values():
+            if validate:
+                obj.full_clean()
+            if 'name' in fields and hasattr(obj, '_name'):
+                # update_fields skips pre_save of fields not listed, so keep the natural-ordering key in step
+                fields.add('_name')
+            if hasattr(obj, 'last_updated'):
+                # Likewise auto_now only fires for listed fields; render caches key on last_updated
+                fields.add('last_updated')
+            obj.save(update_fields=sorted(fields))
+        flushed = len(self._dirty)
+        self._dirty = {}
+        return flushed
+
+
+class InterfaceIndex:
+    """
+    The interfaces of one onboarding run, keyed by (device id, name).
+    load() reads every member's interfaces in one query once their names are
+    final; interfaces created or passed in later are add()ed, so the LAG,
+    uplink and leaf peer lookups that follow cost no query at all.
+    """
+    def __init__(self):
+        self._interfaces = {}
+
+    def load(self, devices: List[Device]) -> 'InterfaceIndex':
+        for intf in Interface.objects.filter(device__in=devices):
+            self.add(intf)
+        return self
+
+    def add(self, *interfaces: Interface) -> None:
+        for intf in interfaces:
+            self._interfaces[(intf.device_id, intf.name)] = intf
+
+    def get(self, device, name) -> Interface:
+        """Look up an interface by device and name, like device.interfaces.get(name=...)."""
+        try:
+            return self._interfaces[(device.pk, name)]
+        except KeyError:
+            raise Interface.DoesNotExist(f"No interface {name} on {device}") from None
+
+    def __contains__(self, key) -> bool:
+        device, name = key
+        return (device.pk, name) in self._interfaces
+
+
+def get_interface_id(device, int_name: str | Interface) -> int:
+    """ Get the ID of an interface on a device. """
+    int_id  = Interface.objects.get(device=device, name=name_of(int_name))
+
+    return int_id.id
+
+def per_switch_with_adding(ap_count: int, num_switches: int) -> Tuple[int,int,int]:
+    """Calculate the number of access points (APs) to assign per switch, ensuring an even distribution.
+    If the total number of APs is not a multiple of the number of switches, additional APs are added to make it so.
+    Args:
+        ap_count (int): The total number of access points to be distributed.
+        num_switches (int): The number of switches among which to distribute the APs.
+    Returns:
+        Tuple[int, int, int]: A tuple containing:
+            - The number of APs assigned per switch.
+            - The total number of APs after adding any necessary extra APs.
+            - The number of additional APs added to achieve an even distribution.
+    """
+    if num_switches < 1:
+        raise ValueError("num_switches must be >= 1")
+    # minimal total that is a multiple of num_switches and >= ap_count
+    remainder = ap_count % num_switches
+    added = 0 if remainder == 0 else (num_switches - remainder)
+    total = ap_count + added
+    per_switch = total // num_switches
+    return per_switch, total, added
+
+def add_member_to_vc(uow: UnitOfWork, device: Device, vc: VirtualChassis, position: int, priority: int):
+    """Add a device as a member to a virtual chassis with specified position and priority."""
+    uow.set(device, virtual_chassis=vc, vc_priority=priority, vc_position=position)
+
+def distribute_items(main_list, ap_count=None, guest_count=None):
+    """
+    Distribute up to ap_count items to ap_list and up to guest_count items to guest_list.
+    Removes assigned items from main_list (returned as a new list).
+    Returns (ap_list, guest_list, main_list).
+    """
+    ap_list = []
+    guest_list = []
+
+    # Assign to ap_list
+    if isinstance(ap_count, int) and ap_count > 0:
+        take_ap = min(ap_count, len(main_list))
+        ap_list = main_list[:take_ap]
+        main_list = main_list[take_ap:]
+
+    # Assign to guest_list (after ap_list has taken its share)
+    if isinstance(guest_count, int) and guest_count > 0:
+        take_guest = min(guest_count, len(main_list))
+        guest_list = main_list[:take_guest]
+        main_list = main_list[take_guest:]
+
+    return main_list, ap_list, guest_list
+
+
+class PortAssignment(NamedTuple):
+    """The final state of one access-layer interface in the port plan."""
+    interface: Interface
+    mode: str
+    description: str
+    untagged_vlan: object
+    tagged_vlans: Tuple = ()
+
+
+class PortInventory(NamedTuple):
+    """
+    The interface templates of one DeviceType, classified once.
+    Names are those of stack member 1; for_member() renumbers them to a VC position.
+    Access ports are kept in allocation order, the reverse of their natural order,
+    as the stages have always allocated from the highest port down.
+    """
+    names: Tuple[str, ...]
+    access: Tuple[str, ...]
+    uplink: Tuple[str, ...]
+    mgmt: Tuple[str, ...]
+    stack: Tuple[str, ...]
+
+    def for_member(self, position: int, names: Tuple[str, ...]) -> List[str]:
+        """Renumber one of the name tuples to a stack member's slot; member 1 keeps the template names."""
+        if position == 1:
+            return list(names)
+        return renumber(names, position)
+
+
+def classify_port(template: InterfaceTemplate) -> str:
+    """Classify an interface template as 'mgmt', 'stack', 'access', 'uplink' or 'other'.
+    Module 0 ports (slot/0/port) are access ports. Other slot/module/port
+    ports, and pluggable ports on fixed models without modules, are uplinks.
+    Management-only and stacking ports are never allocated; the remaining
+    slot 0 ports (GigabitEthernet0/0, ...) count as management, and the
+    remaining slot/port ports of fixed models (GigabitEthernet1/5 on an
+    IE-4000) as access ports.
+    """
+    if template.mgmt_only:
+        return 'mgmt'
+    if 'stack' in template.type:
+        return 'stack'
+    if '/0/' in template.name:
+        return 'access'
+    if template.name.count('/') >= 2 or 'sfp' in template.type:
+        return 'uplink'
+    if template.name.lstrip(string.ascii_letters + '-').startswith('0/'):
+        return 'mgmt'
+    if template.name.count('/') == 1:
+        return 'access'
+    return 'other'
+
+
+def build_port_inventory(templates: Iterable[InterfaceTemplate]) -> PortInventory:
+    """Classify one device type's interface templates into a PortInventory."""
+    groups = defaultdict(list)
+    names = []
+    for template in templates:
+        names.append(template.name)
+        groups[classify_port(template)].append(template.name)
+
+    def ordered(role, reverse=False):
+        return tuple(sorted(groups[role], key=lambda name: naturalize_interface(name, max_length=100), reverse=reverse))
+
+    return PortInventory(
+        names=tuple(names),
+        access=ordered('access', reverse=True),
+        uplink=ordered('uplink'),
+        mgmt=ordered('mgmt'),
+        stack=ordered('stack'),
+    )
+
+
+class PortInventoryIndex:
+    """
+    Process-level PortInventory per DeviceType, built from its interface
+    templates in one query the first time it is needed. Saving or deleting an
+    interface template drops its device type's entry; entries also expire
+    after `ttl` seconds so edits made through another process are picked up.
+    """
+    def __init__(self, ttl: int = 300):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, device_type) -> PortInventory:
+        device_type_id = getattr(device_type, 'pk', device_type)
+        entry = self._entries.get(device_type_id)
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+        inventory = build_port_inventory(InterfaceTemplate.objects.filter(device_type_id=device_type_id).only('name', 'type', 'mgmt_only'))
+        with self._lock:
+            self._entries[device_type_id] = (inventory, time.monotonic() + self.ttl)
+        return inventory
+
+    def invalidate(self, device_type_id=None) -> None:
+        """Drop one device type's inventory, or all of them when no id is given."""
+        with self._lock:
+            if device_type_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(device_type_id, None)
+
+    def _on_change(self, sender, instance, **kwargs):
+        device_type_id = instance.pk if sender is DeviceType else instance.device_type_id
+        if device_type_id is not None:
+            self.invalidate(device_type_id)
+
+    def connect(self) -> None:
+        """Invalidate a device type's inventory whenever one of its interface templates, or the type itself, changes."""
+        for model in (InterfaceTemplate, DeviceType):
+            post_save.connect(self._on_change, sender=model)
+            post_delete.connect(self._on_change, sender=model)
+
+
+port_inventory = PortInventoryIndex()
+port_inventory.connect()
+
+def record_bulk_changes(changes: Iterable[Tuple[object, dict, dict]], action: str = ObjectChangeActionChoices.ACTION_UPDATE) -> int:
+    """Write change-log records for objects that were saved with a bulk query.
+    bulk_update()/bulk_create() bypass the post_save signal that normally
+    records an ObjectChange, so the stages record them here in one INSERT.
+    Args:
+        changes: (object, prechange_data, postchange_data) tuples.
+        action (str): The ObjectChange action to record.
+    Returns:
+        int: The number of change records written.
+    """
+    request = current_request.get()
+    if request is None:
+        return 0
+    records = []
+    for obj, prechange, postchange in changes:
+        records.append(ObjectChange(
+            changed_object=obj,
+            related_object=getattr(obj, 'device', None),
+            object_repr=str(obj)[:200],
+            action=action,
+            prechange_data=prechange or None,
+            postchange_data=postchange or None,
+            user=request.user,
+            user_name=request.user.username,
+            request_id=request.id,
+        ))
+    ObjectChange.objects.bulk_create(records)
+    return len(records)
+
+
+def plan_port_assignments(main_switch, ap_ports, blan_ports, guest_ports, blan, guest) -> List[PortAssignment]:
+    """Build the port plan for AP, BLAN and guest ports without touching the database.
+    Args:
+        main_switch (Device): The stack master, used to name the AP ports.
+        ap_ports, blan_ports, guest_ports: Interfaces allocated by distribute_items().
+        blan (VLAN): Business LAN VLAN, also the native VLAN of AP trunks.
+        guest (VLAN): Wired guest VLAN.
+    Returns:
+        List[PortAssignment]: One entry per interface, in allocation order.
+    """
+    plan = []
+    for idx, ap_int in enumerate(ap_ports, start=1):
+        plan.append(PortAssignment(ap_int, InterfaceModeChoices.MODE_TAGGED, f"<<remotehost={main_switch}-wif-0{idx}>>", blan, (blan,)))
+    for b_int in blan_ports:
+        plan.append(PortAssignment(b_int, InterfaceModeChoices.MODE_ACCESS, "<<remotehost=User>>", blan))
+    for g_int in guest_ports:
+        plan.append(PortAssignment(g_int, InterfaceModeChoices.MODE_ACCESS, "<<remotehost=User>>", guest))
+    return plan
+
+
+def validate_port_plan(plan: List[PortAssignment], site) -> None:
+    """Validate the whole port plan in memory, covering the checks Interface.full_clean() makes for these fields.
+    Args:
+        plan (List[PortAssignment]): The plan built by plan_port_assignments().
+        site (Site): The site the switch is being onboarded to.
+    Raises:
+        ValidationError: Listing every problem found in the plan.
+    """
+    errors = []
+    seen = set()
+    for entry in plan:
+        intf = entry.interface
+        if intf.pk in seen:
+            errors.append(f"{intf.name}: allocated to more than one port role")
+        seen.add(intf.pk)
+        if intf.is_virtual or intf.is_lag:
+            errors.append(f"{intf.name}: {intf.type} interfaces cannot be used as access ports")
+        if entry.mode not in (InterfaceModeChoices.MODE_ACCESS, InterfaceModeChoices.MODE_TAGGED):
+            errors.append(f"{intf.name}: unsupported mode {entry.mode}")
+        if entry.tagged_vlans and entry.mode != InterfaceModeChoices.MODE_TAGGED:
+            errors.append(f"{intf.name}: tagged VLANs require tagged mode")
+        for vlan in (entry.untagged_vlan, *entry.tagged_vlans):
+            if vlan.site_id not in (site.pk, None):
+                errors.append(f"{intf.name}: VLAN {vlan} does not belong to site {site}")
+    if errors:
+        raise ValidationError(errors)
+
+
+def apply_port_plan(plan: List[PortAssignment]) -> Tuple[int, int]:
+    """Write a validated port plan with one bulk UPDATE and one bulk through-table INSERT.
+    Args:
+        plan (List[PortAssignment]): A plan that passed validate_port_plan().
+    Returns:
+        Tuple[int, int]: Interfaces updated and tagged VLAN rows inserted.
+    """
+    interfaces = []
+    changes = []
+    now = timezone.now()
+    for entry in plan:
+        intf = entry.interface
+        prechange = {'mode': intf.mode, 'description': intf.description, 'untagged_vlan': intf.untagged_vlan_id}
+        intf.mode = entry.mode
+        intf.description = entry.description
+        intf.untagged_vlan = entry.untagged_vlan
+        # bulk_update() skips auto_now; bump it so segment render caches see the change
+        intf.last_updated = now
+        interfaces.append(intf)
+        changes.append((intf, prechange, {
+            'mode': intf.mode,
+            'description': intf.description,
+            'untagged_vlan': intf.untagged_vlan_id,
+            'tagged_vlans': [vlan.pk for vlan in entry.tagged_vlans],
+        }))
+    Interface.objects.bulk_update(interfaces, ['mode', 'description', 'untagged_vlan', 'last_updated'])
+
+    through = Interface.tagged_vlans.through
+    rows = [
+        through(interface_id=entry.interface.pk, vlan_id=vlan.pk)
+        for entry in plan
+        for vlan in entry.tagged_vlans
+    ]
+    through.objects.bulk_create(rows, ignore_conflicts=True)
+    record_bulk_changes(changes)
+    return len(interfaces), len(rows)
+
+
+def renumber_stack_members(devices: List) -> int:
+    """Renumber the interfaces of stack members 2..N to their VC position in constant query count.
+    All member interfaces are loaded in one query, every new name is computed
+    up front and checked for collisions, then each member is written with a
+    single bulk UPDATE of name and its natural-ordering key.
+    Args:
+        devices (List[Device]): Stack members in VC position order, master first.
+    Returns:
+        int: The number of interfaces renamed.
+    Raises:
+        ValidationError: If a new name would collide with another interface on the same member.
+    """
+    members = devices[1:]
+    if not members:
+        return 0
+    by_device = defaultdict(list)
+    for intf in Interface.objects.filter(device__in=members):
+        by_device[intf.device_id].append(intf)
+
+    renames = {}
+    errors = []
+    for position, device in enumerate(devices[1:], start=2):
+        interfaces = by_device[device.pk]
+        new_names = renumber(interfaces, position)
+        owners = {intf.name: intf.pk for intf in interfaces}
+        claimed = {}
+        for intf, new_name in zip(interfaces, new_names):
+            if new_name == intf.name:
+                continue
+            if new_name in claimed or owners.get(new_name, intf.pk) != intf.pk:
+                errors.append(f"{device.name}: {intf.name} -> {new_name} collides with an existing interface")
+            claimed[new_name] = intf.pk
+        renames[device.pk] = [(intf, new_name) for intf, new_name in zip(interfaces, new_names) if new_name != intf.name]
+    if errors:
+        raise ValidationError(errors)
+
+    renamed = 0
+    changes = []
+    now = timezone.now()
+    for device in members:
+        interfaces = []
+        for intf, new_name in renames[device.pk]:
+            changes.append((intf, {'name': intf.name}, {'name': new_name}))
+            intf.name = new_name
+            intf._name = naturalize_interface(new_name, max_length=100)
+            intf.last_updated = now
+            interfaces.append(intf)
+        if interfaces:
+            Interface.objects.bulk_update(interfaces, ['name', '_name', 'last_updated'])
+            renamed += len(interfaces)
+    record_bulk_changes(changes)
+    return renamed
+
+
+def connect_uplinks(script, connections: List[Tuple[Interface, Interface]], tenant, cable_paths: list = None) -> List[Cable]:
+    """Cable each (access switch interface, leaf interface) pair as an uplink, with grouped writes.
+    Each cable is validated with full_clean() as Cable.save() would, then all
+    cables and all terminations are inserted with one bulk query each and
+    the interfaces get their cable in one bulk UPDATE. Path tracing is
+    deferred until everything is written, or to the caller when
+    `cable_paths` is given, instead of running on every Cable save.
+    Args:
+        script (Script): The running script, used for job log output.
+        connections: (A side, B side) interface pairs.
+        tenant (Tenant): Tenant of the new cables.
+        cable_paths (list): When given, receives the endpoint sets to pass to trace_cable_paths() instead of tracing them here.
+    Returns:
+        List[Cable]: The new cables.
+    Raises:
+        ValidationError: If an interface is already cabled, used twice or cannot take a cable, or a cable does not validate.
+    """
+    if not connections:
+        return []
+    interfaces = [intf for connection in connections for intf in connection]
+    errors = []
+    seen = set()
+    for intf in interfaces:
+        if intf.pk in seen:
+            errors.append(f"{intf.device} {intf.name} is used by more than one cable")
+        seen.add(intf.pk)
+        if intf.is_virtual or intf.mark_connected:
+            errors.append(f"{intf.device} {intf.name} cannot be cabled")
+    interface_type = ContentType.objects.get_for_model(Interface)
+    cabled = set(CableTermination.objects.filter(termination_type=interface_type, termination_id__in=seen).values_list('termination_id', flat=True))
+    errors.extend(f"{intf.device} {intf.name} is already cabled" for intf in interfaces if intf.pk in cabled)
+
+    cables = []
+    for a_side, b_side in connections:
+        cable = Cable(
+            type="smf",
+            label="Uplink to Dis/leaf",
+            status="connected",
+            tenant=tenant,
+            color="00ff00",
+            description="Access SW to Dis/Leaf SW",
+        )
+        cable.a_terminations = [a_side]
+        cable.b_terminations = [b_side]
+        try:
+            cable.full_clean()
+        except ValidationError as exc:
+            errors.extend(f"{a_side.name} - {b_side.name}: {message}" for message in exc.messages)
+        # bulk_create() skips Cable.save(), which normalises the length fields
+        if cable.length is not None and cable.length_unit:
+            cable._abs_length = to_meters(cable.length, cable.length_unit)
+        else:
+            cable._abs_length = None
+        if cable.length is None:
+            cable.length_unit = None
+        cables.append(cable)
+    if errors:
+        raise ValidationError(errors)
+    cables = Cable.objects.bulk_create(cables)
+    terminations = []
+    now = timezone.now()
+    for cable, connection in zip(cables, connections):
+        for cable_end, intf in zip('AB', connection):
+            termination = CableTermination(cable=cable, cable_end=cable_end, termination=intf)
+            termination.cache_related_objects()
+            terminations.append(termination)
+            intf.cable = cable
+            intf.cable_end = cable_end
+            intf.last_updated = now
+    CableTermination.objects.bulk_create(terminations)
+    Interface.objects.bulk_update(interfaces, ['cable', 'cable_end', 'last_updated'])
+    record_bulk_changes(
+        ((cable, {}, {'label': cable.label, 'type': cable.type, 'status': cable.status, 'a_terminations': [a.pk], 'b_terminations': [b.pk]}) for cable, (a, b) in zip(cables, connections)),
+        ObjectChangeActionChoices.ACTION_CREATE,
+    )
+    record_bulk_changes((intf, {'cable': None}, {'cable': intf.cable_id, 'cable_end': intf.cable_end}) for intf in interfaces)
+
+    endpoints = [[intf] for intf in interfaces]
+    if cable_paths is None:
+        trace_cable_paths(endpoints)
+    else:
+        cable_paths.extend(endpoints)
+    for cable, connection in zip(cables, connections):
+        script.log_success(f"Cable {cable.label} with id {cable.id} created and connected between {connection[0].name} and {connection[1].name}")
+    return cables
+
+
+def trace_cable_paths(endpoints: Iterable[List[Interface]]) -> int:
+    """Trace the CablePath from each cable end, one create_cablepath() per end.
+    An end listed more than once is traced once.
+    Args:
+        endpoints: Interface lists, one per cable end, as collected by connect_uplinks().
+    Returns:
+        int: The number of paths traced.
+    """
+    traced = set()
+    for origins in endpoints:
+        key = frozenset(intf.pk for intf in origins)
+        if key in traced:
+            continue
+        traced.add(key)
+        create_cablepath(list(origins))
+    return len(traced)
+
+
+def resolve_references() -> dict:
+    """Resolve the reference objects every onboarding run assigns to the new devices."""
+    return {
+        'role': reference_cache.get(DeviceRole, name='Access Switch'),
+        'config_template': reference_cache.get(ConfigTemplate, name='master_temp_acc_v1'),
+        'tenant': reference_cache.get(Tenant, name="Consulting"),
+    }
+
+
+def onboard_switch(script, data: dict, refs: dict, phases: PhaseRecorder = None, cable_paths: list = None):
+    """Provision one access switch or stack: devices, VC, VLANs, access ports, uplinks and cabling.
+    Args:
+        script (Script): The running script, used for job log output.
+        data (dict): The DeviceOnboardingVersioning form data, or an equivalent manifest row.
+        refs (dict): Reference objects returned by resolve_references().
+        phases (PhaseRecorder): Receives the per-phase timings; a private one is used when omitted.
+        cable_paths (list): Collects the uplink endpoints for a later trace_cable_paths(); paths are traced here when omitted.
+    Returns:
+        Device: The standalone switch or stack master.
+    """
+    phases = phases or PhaseRecorder()
+    with phases:
+        uow = UnitOfWork()
+        main_switch = _onboard_switch(script, data, refs, uow, phases, cable_paths)
+        phases.start('flush')
+        flushed = uow.flush()
+    script.log_info(f"Onboarding of {main_switch.name} took {phases.count} queries ({flushed} objects flushed once by the unit of work)\n\n{phases.table()}")
+    return main_switch
+
+
+def _onboard_switch(script, data: dict, refs: dict, uow: UnitOfWork, phases: PhaseRecorder, cable_paths: list = None):
+    switch_role = refs['role']
+    config_template = refs['config_template']
+    tenant = refs['tenant']
+
+    # Determine stack count: 1 if not stack, or user-specified count if stack
+    stack_count = data.get("stack_member_count") if data.get("is_stack_switch") else 1
+
+    # Ensure stack_count is at least 1
+    #stack_count = max(1, int(data.get("stack_member_count", 1)))
+
+    phases.start('device create')
+    devices = []
+    for i in range(1, stack_count + 1):
+        # First device uses device_name, others use device_name + index
+        if i == 1:
+            name = data['device_name']
+        else:
+            name = f"{data['device_name']}{i}"
+
+        switch = Device(
+            device_type=data['switch_model'],
+            name=name,
+            site=data['site'],
+            status=DeviceStatusChoices.STATUS_ACTIVE,
+            role=switch_role,
+            platform=data['platform'],
+            tenant=tenant,
+            config_template=config_template,
+        )
+        switch.custom_field_data["gateway"] = data["gateway_address"]
+        switch.full_clean()
+        switch.save()
+        devices.append(switch)
+        script.log_success(f"Created switch: {switch.name} with {switch.interfaces.all().count()} interfaces")
+
+    phases.start('VC build')
+    if data['is_stack_switch'] and (stack_count > 1):
+        script.log_success(f"Stack creation complete. Total members: {len(devices)}")
+        vc = VirtualChassis.objects.create(
+            name=data['device_name'],
+            description=data['device_name'],
+        )
+        for idx, device in enumerate(devices, start=1):
+            pr = 16 - idx
+            add_member_to_vc(uow, device, vc, idx, pr)
+        uow.set(vc, master=devices[0])
+
+    phases.start('renumber')
+    renamed = renumber_stack_members(devices)
+    if renamed:
+        script.log_success(f"Interface names have been updated for stack members 2-{len(devices)} ({renamed} interfaces)")
+
+    phases.start('VLAN group')
+    vlan_group = VLANGroup.objects.create(
+                    name=data["device_name"],
+                    slug=slugify(data["device_name"]),
+                    scope_type=reference_cache.content_type(Site),
+                    scope_id=data['site'].id,
+                    description="vlan_grp",
+                )
+    script.log_success(f"Created new vlan group: {vlan_group}")
+    blan = VLAN.objects.create(
+                    group=vlan_group,
+                    vid=data["blan_vlan"],
+                    name="blan",
+                    status="active",
+                    site=data['site'],
+                    description="Business LAN",
+                )
+    mgmt = VLAN.objects.create(
+            group=vlan_group,
+            vid=data["mgmt_vlan"],
+            name="mgmt",
+            status="active",
+            site=data['site'],
+            description="Mgmt Vlan",
+        )
+    guest = VLAN.objects.create(
+            group=vlan_group,
+            vid=data["guest_vlan"],
+            name="guest",
+            status="active",
+            site=data['site'],
+            description="Guest Vlan",
+        )
+    script.log_success(f"Created new vlans and added to group: VLANGroup: {vlan_group}, VLANs: {blan}:{mgmt}:{guest}")
+
+    main_switch = devices[0]
+
+    phases.start('LAG and mgmt interfaces')
+    for idx, device in enumerate(devices, start=1):
+        uow.set_custom_field(device, "vlan_group", vlan_group.id)
+
+        if idx == 1:
+            interface_portc = Interface.objects.create(
+                device=device,
+                name=data["lag_name"],
+                type="lag",
+                description=data["lag_desc"],
+                mode='tagged'
+            )
+            interface_mgmt = Interface.objects.create(
+                device=device,
+                name=f'vlan{str(data["mgmt_vlan"])}',
+                type="virtual",
+                description="mgmt interface",
+            )
+
+            if data['is_stack_switch'] and (stack_count > 1):
+                script.log_success(f"Created new Po1 and mgmt int vlan: {interface_mgmt}, Portchannel:{interface_portc} on member {idx}")
+            else:
+                script.log_success(f"Created new Po1 and mgmt int vlan: {interface_mgmt}, Portchannel:{interface_portc}")
+
+        elif idx == len(devices):
+            interface_portc = Interface.objects.create(
+            device=device,
+            name=data["lag_name"],
+            type="lag",
+            description=data["lag_desc"],
+            )
+            script.log_success(f"Created new Po1: Portchannel:{interface_portc} on member {idx}")
+
+    mgmt_ip = IPAddress.objects.create(
+        address=data['mgmt_address'],
+        status="active",
+        description=data["device_name"],
+    )
+    script.log_success(f"Created IP Address: Mgmt IP: {mgmt_ip}")
+
+    mgmt_ip.assigned_object = interface_mgmt
+    mgmt_ip.save()
+
+    uow.set(main_switch, primary_ip4=mgmt_ip)
+    script.log_success(f"Primary IPv4 address: {devices[0].primary_ip4.address} on {main_switch.name}")
+
+    phases.start('port allocation')
+    blan_user_port = []
+    guest_user_port = []
+    ap_port = []
+
+    if data['is_stack_switch'] and (stack_count > 1):
+        if data["ap_count"]:
+            ap_count = per_switch_with_adding(data["ap_count"], len(devices))[0]
+        else:
+            ap_count = 0
+        if data["guest_count"]:
+            guest_count = per_switch_with_adding(data["guest_count"], len(devices))[0]
+        else:
+            guest_count = 0
+    else:
+        ap_count = data["ap_count"]
+        guest_count = data["guest_count"]
+
+    # Every member interface is loaded once, after renumbering; all lookups from here on are served by the index
+    interfaces = InterfaceIndex().load(devices)
+    # Access ports come from the device type's port inventory
+    inventory = port_inventory.get(data['switch_model'])
+    for idx, device in enumerate(devices, start=1):
+        usable_int = [interfaces.get(device, name) for name in inventory.for_member(idx, inventory.access) if (device, name) in interfaces]
+        blan_list, ap_list, guest_list = distribute_items(usable_int, ap_count, guest_count)
+        blan_user_port.extend(blan_list)
+        ap_port.extend(ap_list)
+        guest_user_port.extend(guest_list)
+
+        if data['is_stack_switch'] and (stack_count > 1):
+            script.log_success(f"Port allocation: BLAN ports = {len(blan_list)}, AP ports = {len(ap_list)}, GUEST ports = {len(guest_list)} on stack member {idx}.")
+        else:
+            script.log_success(f"Port allocation: BLAN ports = {len(blan_list)}, AP ports = {len(ap_list)}, GUEST ports = {len(guest_list)}")
+
+    script.log_success(f"Total ports — BLAN: {len(blan_user_port)}, GUEST: {len(guest_user_port)}, AP: {len(ap_port)}")
+
+    port_plan = plan_port_assignments(main_switch, ap_port, blan_user_port, guest_user_port, blan, guest)
+    validate_port_plan(port_plan, data['site'])
+    updated, tagged_rows = apply_port_plan(port_plan)
+    script.log_success(f"Port plan applied: {updated} interfaces updated, {tagged_rows} tagged VLAN assignments")
+
+    script.log_success("Updated all interfaces as required....................................")
+
+    phases.start('uplinks')
+    trunk_vlans = [blan, mgmt, guest]
+    trunk_vids = [vlan.vid for vlan in trunk_vlans]
+    lag_int = interfaces.get(main_switch, data["lag_name"])
+    lag_int.tagged_vlans.add(*trunk_vlans)
+    script.log_success(f"Update interface Lag: {lag_int}")
+
+    uplink1_int = interfaces.get(main_switch, data["uplink_1"])
+    uow.set(
+        uplink1_int,
+        mode="tagged",
+        description=f"<<remotehost={data['uplink_sw_a'].name}; port={data['uplink_intf_sw_a'].name}>>",
+        lag=lag_int,
+    )
+    uplink1_int.tagged_vlans.set(trunk_vlans)
+
+    if data['is_stack_switch'] and (stack_count > 1):
+        script.log_success(f"Update uplink 1: {uplink1_int} tagged={trunk_vids} on stack member 1")
+    else:
+        script.log_success(f"Update uplink 1: {uplink1_int} tagged={trunk_vids}")
+
+    if data["uplink_2"] and data["uplink_intf_sw_b"]:
+        if data['is_stack_switch'] and (stack_count > 1):
+            uplink_new = member_uplink(data["uplink_2"], len(devices))
+            uplink2_int = interfaces.get(devices[-1], uplink_new)
+        else:
+            uplink2_int = interfaces.get(devices[-1], data["uplink_2"])
+
+        uow.set(
+            uplink2_int,
+            mode="tagged",
+            description=f"<<remotehost={data['uplink_sw_b'].name}; port={data['uplink_intf_sw_b'].name}>>",
+            lag=interfaces.get(devices[-1], data["lag_name"]),
+        )
+        uplink2_int.tagged_vlans.set(trunk_vlans)
+
+        if data['is_stack_switch'] and (stack_count > 1):
+            script.log_success(f"Update uplink 2: {uplink2_int} tagged={trunk_vids} on stack member {len(devices)}")
+        else:
+            script.log_success(f"Update uplink 2: {uplink2_int} tagged={trunk_vids}")
+
+    phases.start('cabling')
+    # The leaf peers are the Interface objects from the form or manifest; no need to look them up again
+    connections = [(uplink1_int, data['uplink_intf_sw_a'])]
+    if data["uplink_2"] and data["uplink_intf_sw_b"]:
+        connections.append((uplink2_int, data['uplink_intf_sw_b']))
+
+    connect_uplinks(script, connections, tenant, cable_paths)
+
+    return main_switch
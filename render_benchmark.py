@@ -0,0 +1,147 @@
+# pylint: cSpell:disable
+# pylint: disable=docstring,line-too-long
+"""
+Render benchmark for the three generations of the access switch template.
+
+access_temp.j2, new_templ.j2, acc_sw_stack_temp and the cisco_iosxe tree are
+rendered for a synthetic standalone switch and a 5-member stack, created by
+the regular onboarding stages inside a transaction that is rolled back.
+For each template the benchmark reports compile time, median render time,
+DB queries per render and peak Python memory (tracemalloc).
+"""
+
+import json
+import statistics
+import time
+import tracemalloc
+
+import onboarding_benchmark
+from config_render import ENTRYPOINT, TEMPLATE_ROOT, RenderProfiler, device_context, get_render_service
+from dcim.models import Device
+from django.conf import settings
+from django.db import transaction
+from extras.scripts import *
+from jinja2 import FileSystemLoader
+from jinja2.sandbox import SandboxedEnvironment
+from onboarding_utils import QueryCounter, onboard_switch, resolve_references
+
+TEMPLATES = ('access_temp.j2', 'new_templ.j2', 'acc_sw_stack_temp', ENTRYPOINT)
+
+# (label, fixture device type, stack members)
+DEVICES = (
+    ('standalone', 'c9300l-24p-4x', 1),
+    ('5-member VC', 'c9300l-24p-4x', 5),
+)
+
+
+def fresh_environment() -> SandboxedEnvironment:
+    """A new environment per template, as ConfigTemplate.render() builds one per call."""
+    environment = SandboxedEnvironment(loader=FileSystemLoader(TEMPLATE_ROOT))
+    environment.filters.update(getattr(settings, 'JINJA2_FILTERS', {}))
+    return environment
+
+
+class TemplateRenderBenchmark(Script):
+    """
+    Compare the render cost of the access switch templates on identical
+    synthetic devices.
+    """
+    class Meta:
+        name = "Template Render Benchmark"
+        description = "Render time, queries and peak memory of the access switch templates on synthetic devices"
+        commit_default = False
+        job_timeout = 1800
+
+    iterations = IntegerVar(
+        default=5,
+        min_value=1,
+        max_value=50,
+        description="Renders per template and device; the median time is reported",
+    )
+
+    def build_device(self, fixtures: dict, key: str, members: int):
+        data = onboarding_benchmark.scenario_data(fixtures, key, members)
+        return onboard_switch(self, data, resolve_references())
+
+    def measure(self, render, iterations: int) -> dict:
+        with QueryCounter() as counter:
+            output = render()
+        times = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            render()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            render()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {'output': output, 'seconds': statistics.median(times), 'queries': counter.count, 'peak_kib': peak // 1024}
+
+    def run(self, data, commit):
+        rows = []
+        with transaction.atomic():
+            fixtures = onboarding_benchmark.build_fixtures()
+            for label, key, members in DEVICES:
+                # Each device gets its own savepoint: both claim the same leaf ports and management address
+                savepoint = transaction.savepoint()
+                try:
+                    device = self.build_device(fixtures, key, members)
+                    for name in TEMPLATES:
+                        start = time.perf_counter()
+                        try:
+                            template = fresh_environment().get_template(name)
+                        except Exception as exc:
+                            self.log_failure(f"{name} does not compile: {exc}")
+                            continue
+                        compile_seconds = time.perf_counter() - start
+                        try:
+                            result = self.measure(lambda: template.render(**device_context(device)), data['iterations'])
+                        except Exception as exc:
+                            self.log_failure(f"{name} failed on the {label} device: {exc}")
+                            continue
+                        rows.append((label, name, compile_seconds, result))
+
+                    # The same tree through the precompiled service with prefetched render data
+                    service = get_render_service()
+                    result = self.measure(lambda: service.render_device(device), data['iterations'])
+                    rows.append((label, f"{ENTRYPOINT} (service)", 0.0, result))
+                finally:
+                    transaction.savepoint_rollback(savepoint)
+            transaction.set_rollback(True)
+        onboarding_benchmark.reset_caches()
+
+        lines = [f"{'device':<12} {'template':<58} {'compile s':>9} {'render s':>9} {'queries':>8} {'peak KiB':>9} {'bytes':>8}"]
+        for label, name, compile_seconds, result in rows:
+            lines.append(
+                f"{label:<12} {name:<58} {compile_seconds:>9.4f} {result['seconds']:>9.4f} {result['queries']:>8} {result['peak_kib']:>9} {len(result['output']):>8}"
+            )
+        return '\n'.join(lines)
+
+
+class TemplateRenderProfile(Script):
+    """
+    Render the cisco_iosxe template for real devices with every segment include
+    and macro call instrumented, and report where the time and queries go.
+    """
+    class Meta:
+        name = "Template Render Profile"
+        description = "Per-segment and per-macro time and ORM queries of the cisco_iosxe template"
+        commit_default = False
+
+    devices = MultiObjectVar(
+        model=Device,
+        description="Devices to render; figures are summed over all of them",
+    )
+    prefetch = BooleanVar(
+        default=True,
+        description="Load render data with the prefetching loader, as the bulk render does (off: plain ConfigTemplate behaviour)",
+    )
+
+    def run(self, data, commit):
+        profiler = RenderProfiler()
+        for device in data['devices']:
+            profiler.render_device(device, prefetch=data['prefetch'])
+        self.log_info(f"Profile over {len(data['devices'])} device(s)\n\n{profiler.profile.table()}")
+        return json.dumps(profiler.profile.stats, indent=2, sort_keys=True)